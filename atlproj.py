@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+'''
+Reads an ATLAS.ti project archive (.atlproj) directly, so the pipeline can run without exporting
+the Quotation, Hyperlink, Document, Code and Hyperlink Relation Managers to Excel first.
+The archive is a zip holding project.aprx (the project as XML: documents, quotations, codes and links)
+and contents/<GUID>/content entries (document and comment texts). project.aprx is parsed as a stream
+and only the content entries of documents and comments that are used are read.
+The data frames have the columns of the matching Excel exports as pandas reads them.
+'''
+
+import sys
+import os
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+import pandas as pd
+
+PROJECT_MEMBER = 'project.aprx'
+QUOTATION_COLUMNS = ['ID', 'Quotation Name', 'Document', 'Document Groups', 'Quotation Content', 'Comment', 'Codes', 'Reference', 'Density']
+LINK_COLUMNS = ['ID', 'Source', 'Unnamed: 2', 'Relation', 'ID.1', 'Target']
+DOCUMENT_COLUMNS = ['ID', 'Document', 'Media Type', 'Comment', 'Location', 'Document Groups', 'Codes', 'Quotation Count']
+CODE_COLUMNS = ['Unnamed: 0', 'Code', 'Comment', 'Grounded', 'Density', 'Code Groups']
+RELATION_COLUMNS = ['Unnamed: 0', 'Relation Type', 'Usage', 'Comment', 'Width', 'Line Style', 'Layout Direction', 'Formal Property', 'Short Name', 'Symbolic Name']
+# ATLAS.ti separates paragraphs in text contents with the unicode paragraph separator
+PARAGRAPH = '\u2029'
+# longest quotation name before it is cut short
+NAME_CHARS = 70
+# most ints between two segments of a content's segment table
+RECORD_INTS = 16
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -i LingCapstone.atlproj -o output_dir/ [-f xlsx]
+    -i project_path         ATLAS.ti project archive
+    -o output_dir           Where to write the Quotation, Hyperlink, Document, Code and Hyperlink Relation Manager tables
+    -f format               Output format: xlsx, csv, parquet or feather (default xlsx)''')
+    sys.exit(exitcode)
+
+def is_project(path):
+    '''
+    return True if the path is an ATLAS.ti project archive
+    '''
+    return os.path.splitext(path)[1].lower() == '.atlproj'
+
+def local_name(tag):
+    '''
+    return str, element name without its namespace
+    '''
+    return tag.rsplit('}', 1)[-1]
+
+def content_text(data):
+    '''
+    Text of an atext3 content entry: a GUID, a table of section offsets, then the text as UTF-16
+    param data: bytes, content entry
+    return str, paragraphs separated by PARAGRAPH (kept in quotation contents, as in the exports)
+    '''
+    start, end = struct.unpack_from('<2Q', data, 24)
+    return data[start:end].decode('utf-16-le')
+
+def content_segments(data):
+    '''
+    Where each segment of an atext3 content entry is in its text. Quotation locations are
+    given as a segment and an offset in it. The segment table after the text holds a
+    (segment #, start, length) triple for every segment, with a length of -2 for paragraph breaks,
+    but its records also carry formatting fields of varying size and segment #s can skip, so the
+    triples are found by following the chain of starts.
+    param data: bytes, content entry
+    return dict of segment # -> (character where it starts, length)
+    '''
+    table, end = struct.unpack_from('<2Q', data, 32)
+    ints = struct.unpack_from(f"<{(end - table - 8) // 4}i", data, table + 8)
+    segments = {}
+    segment, start, at = 0, 0, 0
+    while True:
+        for i in range(at, min(at + RECORD_INTS, len(ints) - 2)):
+            if ints[i] > segment and ints[i + 1] == start:
+                break
+        else:
+            return segments
+        segment = ints[i]
+        segments[segment] = (start, max(ints[i + 2], 1))
+        start += segments[segment][1]
+        at = i + 3
+
+def quotation_span(segments, location):
+    '''
+    Characters of the document text a quotation covers
+    param segments: dict from content_segments
+    param location: dict, segmentedTextLoc attributes (segments and offsets within them,
+    a negative offset stands for the end of the segment)
+    return (start, end)
+    '''
+    start, length = segments[int(location['sSegment'])]
+    start += int(location['sOffset'])
+    end, length = segments[int(location['eSegment'])]
+    end += length if int(location['eOffset']) < 0 else int(location['eOffset'])
+    return start, end
+
+def quotation_name(text):
+    '''
+    return str, quotation name the way ATLAS.ti lists it: the text without surrounding whitespace,
+    cut short after NAME_CHARS characters
+    '''
+    text = text.strip()
+    return text if len(text) <= NAME_CHARS else text[:NAME_CHARS].rstrip() + '…'
+
+def parse_project(zf):
+    '''
+    Stream project.aprx and collect what the exports are built from
+    param zf: open zipfile of the archive
+    return dict of lists and lookups: contents, media, documents, quotations, tags, relations (id -> name),
+    relation types (attributes of each), links, codings
+    '''
+    project = {'contents': {}, 'media': {}, 'documents': [], 'quotations': [], 'tags': {}, 'relations': {}, 'relation types': [], 'links': [], 'codings': []}
+    document = None
+    with zf.open(PROJECT_MEMBER) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            tag = local_name(elem.tag)
+            if event == 'start':
+                if tag == 'document':
+                    document = dict(elem.attrib)
+                    project['documents'].append(document)
+                continue
+            if tag == 'content' and 'loc' in elem.attrib:
+                project['contents'][elem.get('id')] = elem.get('loc')
+            elif tag == 'medium':
+                project['media'][elem.get('id')] = elem.get('content')
+            elif tag == 'quotation':
+                location = comment = None
+                for child in elem.iter():
+                    if local_name(child.tag) == 'segmentedTextLoc':
+                        location = dict(child.attrib)
+                    elif local_name(child.tag) == 'comment':
+                        comment = child.get('content')
+                project['quotations'].append({
+                    'id': elem.get('id'),
+                    'number': int(elem.get('number')),
+                    'document': document,
+                    'location': location,
+                    'comment': comment,
+                })
+                elem.clear()
+            elif tag == 'tag':
+                project['tags'][elem.get('id')] = elem.get('name')
+            elif tag == 'quotQuotRel':
+                project['relations'][elem.get('id')] = elem.get('name')
+                project['relation types'].append(dict(elem.attrib))
+            elif tag == 'quotQuotLink':
+                project['links'].append((elem.get('rel'), elem.get('source'), elem.get('target')))
+                elem.clear()
+            elif tag == 'tagQuotLink':
+                project['codings'].append((elem.get('source'), elem.get('target')))
+                elem.clear()
+    return project
+
+class Project:
+    '''
+    Tables of an ATLAS.ti project archive, built on first use
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            self.project = parse_project(zf)
+            self.texts = self.read_texts(zf)
+        self._quotations = None
+
+    def read_texts(self, zf):
+        '''
+        Read the content entries of the documents and comments that are used
+        param zf: open zipfile of the archive
+        return dict of content id -> text
+        '''
+        project = self.project
+        wanted = {project['media'].get(document.get('medium')) for document in project['documents']}
+        wanted |= {quotation['comment'] for quotation in project['quotations']}
+        wanted.discard(None)
+        texts = {}
+        for content in wanted:
+            loc = project['contents'].get(content)
+            if loc is not None:
+                data = zf.read(f"contents/{loc}/content")
+                texts[content] = (content_text(data), content_segments(data))
+        return texts
+
+    def quotations(self):
+        '''
+        return quotations data frame, like a Quotation Manager export
+        '''
+        if self._quotations is not None:
+            return self._quotations.copy()
+        project = self.project
+        codes = {}
+        for tag, quotation in project['codings']:
+            codes.setdefault(quotation, []).append(project['tags'][tag])
+        # links to other quotations and to codes
+        density = pd.Series([q for link in project['links'] for q in link[1:]] + [q for tag, q in project['codings']]).value_counts()
+        rows = []
+        for quotation in project['quotations']:
+            document = quotation['document']
+            content = project['media'].get(document.get('medium'))
+            location = quotation['location']
+            text = first = last = None
+            if location and content in self.texts:
+                full, segments = self.texts[content]
+                start, end = quotation_span(segments, location)
+                text = full[start:end]
+                first = full.count(PARAGRAPH, 0, start) + 1
+                last = full.count(PARAGRAPH, 0, max(end - 1, start)) + 1
+            comment = self.texts[quotation['comment']][0] if quotation['comment'] in self.texts else None
+            rows.append({
+                'ID': f"{document['number']}:{quotation['number']}",
+                'Quotation Name': quotation_name(text) if text is not None else None,
+                'Document': document['name'],
+                'Document Groups': None,
+                'Quotation Content': text,
+                'Comment': comment or None,
+                'Codes': '\n'.join(sorted(codes[quotation['id']])) if quotation['id'] in codes else None,
+                'Reference': f"{first} - {last}" if text is not None else None,
+                'Density': int(density.get(quotation['id'], 0)),
+            })
+        self._quotations = pd.DataFrame(rows, columns=QUOTATION_COLUMNS)
+        return self._quotations.copy()
+
+    def links(self):
+        '''
+        return links data frame, like a Hyperlink Manager export
+        '''
+        qdf = self.quotations()
+        by_id = {quotation['id']: i for i, quotation in enumerate(self.project['quotations'])}
+        rel, source, target = zip(*self.project['links']) if self.project['links'] else ((), (), ())
+        s = [by_id[q] for q in source]
+        t = [by_id[q] for q in target]
+        return pd.DataFrame({
+            'ID': qdf['ID'].to_numpy()[s],
+            'Source': qdf['Quotation Name'].to_numpy()[s],
+            'Unnamed: 2': '○',
+            'Relation': [self.project['relations'][r] for r in rel],
+            'ID.1': qdf['ID'].to_numpy()[t],
+            'Target': qdf['Quotation Name'].to_numpy()[t],
+        }, columns=LINK_COLUMNS)
+
+    def documents(self):
+        '''
+        return documents data frame, like a Document Manager export
+        '''
+        qdf = self.quotations()
+        codes = qdf['Codes'].str.split('\n').groupby(qdf['Document']).agg(lambda lists: '\n'.join(sorted({c for l in lists.dropna() for c in l})))
+        rows = []
+        for document in self.project['documents']:
+            name = document['name']
+            rows.append({
+                'ID': int(document['number']),
+                'Document': name,
+                'Media Type': 'Text',
+                'Comment': None,
+                'Location': 'Library',
+                'Document Groups': None,
+                'Codes': codes.get(name) or None,
+                'Quotation Count': int((qdf['Document'] == name).sum()),
+            })
+        return pd.DataFrame(rows, columns=DOCUMENT_COLUMNS)
+
+    def codes(self):
+        '''
+        return codes data frame, like a Code Manager export
+        '''
+        grounded = pd.Series([tag for tag, quotation in self.project['codings']]).value_counts()
+        names = sorted(self.project['tags'].items(), key=lambda item: item[1])
+        return pd.DataFrame({
+            'Unnamed: 0': '○',
+            'Code': [name for tag, name in names],
+            'Comment': None,
+            'Grounded': [int(grounded.get(tag, 0)) for tag, name in names],
+            'Density': 0,
+            'Code Groups': None,
+        }, columns=CODE_COLUMNS)
+
+    def relations(self):
+        '''
+        return relation types data frame, like a Hyperlink Relation Manager export
+        '''
+        usage = pd.Series([rel for rel, source, target in self.project['links']]).value_counts()
+        rows = []
+        for relation in self.project['relation types']:
+            rows.append({
+                'Unnamed: 0': '○',
+                'Relation Type': relation['name'],
+                'Usage': int(usage.get(relation['id'], 0)),
+                'Comment': None,
+                'Width': 1,
+                'Line Style': 'Solid',
+                'Layout Direction': 'left–right' if relation.get('layoutDirection') == 'leftToRight' else 'right–left',
+                'Formal Property': 'Symmetric' if relation.get('symmetric') == 'true' else 'Asymmetric',
+                'Short Name': relation.get('shortName') or None,
+                'Symbolic Name': relation.get('symbolicName') or None,
+            })
+        return pd.DataFrame(rows, columns=RELATION_COLUMNS)
+
+# projects read so far, so the quotations and links of one archive are parsed once
+projects = {}
+
+def read_table(path, table):
+    '''
+    Read one table of a project archive, like reading the matching export
+    param path: str, project archive path
+    param table: str, 'quotations', 'links', 'documents', 'codes' or 'relations'
+    return data frame
+    '''
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in projects:
+        projects[key] = Project(path)
+    return getattr(projects[key], table)()
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    fmt = 'xlsx'
+    if len(arguments) < 4:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-i':
+            project_path = arguments.pop(0)
+        elif argument == '-o':
+            output_dir = arguments.pop(0)
+        elif argument == '-f':
+            fmt = arguments.pop(0)
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data files exists
+    if not os.path.exists(project_path):
+        usage(1)
+
+    import cache
+    project = Project(project_path)
+    os.makedirs(output_dir, exist_ok=True)
+    tables = {'Quotation Manager': project.quotations(), 'Hyperlink Manager': project.links(), 'Document Manager': project.documents(), 'Code Manager': project.codes(), 'Hyperlink Relation Manager': project.relations()}
+    for name, df in tables.items():
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        if fmt == 'xlsx':
+            df.to_excel(path, index=False)
+        else:
+            cache.write_table(df, path)
+        print(f"{len(df)} rows -> {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+'''
+Times and memory-profiles each pipeline stage on synthetic projects of increasing size
+(see synthetic.py) and writes the results to a JSON or CSV file so runs can be compared
+across commits. Each stage is run on a fresh copy of its input, once untraced for the
+time and once under tracemalloc for the peak memory it allocates.
+'''
+
+import sys
+import os
+import io
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+import combineql
+import distance
+import percentage
+import validation
+import cache
+import synthetic
+
+QUOTES_PER_DOC = 1000
+LINKS_PER_QUOTE = 0.75
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -o results.json [-n 1000,10000,100000 -x max_excel_links -k repeat -s seed]
+    -o results_path    Results file (.json or .csv)
+    -n links           Comma separated project sizes in links (default 1000,10000,100000)
+    -x max_excel_links Skip the Excel I/O stages above this many links (default 10000)
+    -k repeat          Runs per stage, the fastest is kept (default 1)
+    -s seed            Random seed for the synthetic projects (default 0)''')
+    sys.exit(exitcode)
+
+def measure(func, df, repeat=1):
+    '''
+    Time and memory-profile one stage
+    param func: function taking a data frame and returning one
+    param df: stage input, copied before every run so stages that modify their input can be rerun
+    param repeat: int, timed runs, the fastest is kept
+    return (stage output, seconds, peak MB allocated while tracing)
+    '''
+    seconds = None
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            out = func(data)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    data = df.copy()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    validation.clear()
+    return out, seconds, peak / 2 ** 20
+
+def project(links, seed, where):
+    '''
+    Generate and load a synthetic project with about this many links
+    param links: int, wanted number of links
+    param seed: int, random seed
+    param where: str, directory for the exports and participant files
+    return (quotations data frame, links data frame, participant files path)
+    '''
+    docs = max(round(links / (QUOTES_PER_DOC * LINKS_PER_QUOTE)), 1)
+    qdf, ldf, transcripts = synthetic.generate(docs, QUOTES_PER_DOC, LINKS_PER_QUOTE, seed=seed)
+    quotations_path, links_path = synthetic.write(qdf, ldf, transcripts, where, 'parquet')
+    qdf = combineql.loadQuotations(quotations_path)
+    ldf = combineql.loadLinks(links_path)
+    return qdf, ldf, where + os.sep
+
+def benchmark(links, seed=0, repeat=1, max_excel_links=10000):
+    '''
+    Run every stage on one synthetic project
+    param links: int, wanted number of links
+    param seed: int, random seed
+    param repeat: int, timed runs per stage
+    param max_excel_links: int, skip the Excel I/O stages for bigger projects
+    return list of dicts, one per stage
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as where:
+        qdf, ldf, ppath = project(links, seed, where)
+        excel_path = os.path.join(where, 'links.xlsx')
+        # transcript indexes go with the project instead of the shared cache
+        index_dir = os.path.join(where, 'transcripts')
+        stages = [
+            ('addCodes', lambda df: combineql.addCodes(df, qdf)),
+            ('validateCodes', combineql.validateCodes),
+            ('cleanText', combineql.cleanText),
+            ('addLines', lambda df: combineql.addLines(df, qdf)),
+            ('addLineDiffs', distance.addLineDiffs),
+            ('addRefDiffs', distance.addRefDiffs),
+            ('get_counts', lambda df: percentage.get_counts(df, ppath, index_dir)[0]),
+        ]
+        if len(ldf) <= max_excel_links:
+            stages += [
+                ('write_excel', lambda df: (cache.write_table(df, excel_path), df)[1]),
+                ('read_excel', lambda df: cache.read_table(excel_path, None)),
+            ]
+        df = ldf
+        for stage, func in stages:
+            out, seconds, peak = measure(func, df, repeat)
+            results.append({'links': len(ldf), 'stage': stage, 'rows_in': len(df), 'rows_out': len(out), 'seconds': seconds, 'peak_mb': peak})
+            print(f"{len(ldf):>9} links  {stage:<14} {seconds:10.4f} s  {peak:10.2f} MB")
+            df = out
+    return results
+
+def commit():
+    '''
+    return str, current git commit of the repo, None outside a git checkout
+    '''
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+def write_results(results, path):
+    '''
+    Write benchmark results, format chosen by extension (.json or .csv)
+    param results: list of dicts from benchmark
+    param path: str, results file path
+    '''
+    info = {
+        'commit': commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+    if os.path.splitext(path)[1].lower() == '.csv':
+        rdf = pd.DataFrame(results)
+        for key, value in info.items():
+            rdf[key] = value
+        rdf.to_csv(path, index=False)
+        return
+    with open(path, 'w') as f:
+        json.dump({**info, 'results': results}, f, indent=2)
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    sizes = [1000, 10000, 100000]
+    max_excel_links = 10000
+    repeat = 1
+    seed = 0
+    if len(arguments) < 2:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-o':
+            results_path = arguments.pop(0)
+        elif argument == '-n':
+            sizes = [int(float(n)) for n in arguments.pop(0).split(',')]
+        elif argument == '-x':
+            max_excel_links = int(float(arguments.pop(0)))
+        elif argument == '-k':
+            repeat = int(arguments.pop(0))
+        elif argument == '-s':
+            seed = int(arguments.pop(0))
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    results = []
+    for links in sizes:
+        results += benchmark(links, seed, repeat, max_excel_links)
+    write_results(results, results_path)
+
+if __name__ == '__main__':
+    main()
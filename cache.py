@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+'''
+On-disk cache of parsed tables so unchanged Excel workbooks are only parsed once.
+Parsed tables are stored as Feather files keyed on the source file's path, size and mtime,
+and read back memory-mapped. Pipeline stages can also read and write Feather/Parquet
+directly, leaving Excel as an optional export format.
+Needs pyarrow; without it every read falls back to parsing the source file.
+'''
+
+import os
+import hashlib
+import pandas as pd
+import stream
+
+CACHE_DIR = os.environ.get('LING_CACHE_DIR', '.lingcache')
+
+def has_pyarrow():
+    '''
+    return True if pyarrow is installed (needed for Feather/Parquet)
+    '''
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+def file_key(path):
+    '''
+    Key identifying one version of a file
+    param path: str, file path
+    return str, hash of the absolute path, size and mtime
+    '''
+    stat = os.stat(path)
+    ident = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+def cache_prefix(path, cache_dir=CACHE_DIR):
+    '''
+    return str, start of the name shared by every cached version of a file
+    '''
+    name = os.path.splitext(os.path.basename(path))[0]
+    where = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{name}.{where}.")
+
+def cache_path(path, cache_dir=CACHE_DIR):
+    '''
+    return str, path of the cached Feather file for the current version of a file
+    '''
+    return cache_prefix(path, cache_dir) + f"{file_key(path)[:16]}.feather"
+
+def prune(path, cache_dir=CACHE_DIR):
+    '''
+    Remove cached versions of a file other than the current one
+    param path: str, source file path
+    '''
+    prefix = cache_prefix(path, cache_dir)
+    current = cache_path(path, cache_dir)
+    for entry in os.listdir(cache_dir):
+        old = os.path.join(cache_dir, entry)
+        if old.startswith(prefix) and old != current:
+            os.remove(old)
+
+def read_feather(path):
+    '''
+    Read a Feather file through a memory map instead of copying it into memory first
+    param path: str, Feather file path
+    return data frame
+    '''
+    from pyarrow import feather
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+def read_table(path, cache_dir=CACHE_DIR):
+    '''
+    Read a table, format chosen by extension (.feather, .parquet, .csv or Excel).
+    Excel workbooks are parsed once and then served from the cache until the file changes.
+    param path: str, input file path
+    param cache_dir: str, cache directory, None to disable caching
+    return data frame
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.feather':
+        return read_feather(path)
+    if ext == '.parquet':
+        return pd.read_parquet(path, memory_map=True)
+    if ext == '.csv':
+        return pd.read_csv(path)
+    if cache_dir is None or not has_pyarrow():
+        return pd.read_excel(path)
+    cached = cache_path(path, cache_dir)
+    if os.path.exists(cached):
+        return read_feather(cached)
+    df = pd.read_excel(path)
+    store(df, cached)
+    prune(path, cache_dir)
+    return df
+
+def store(df, cached):
+    '''
+    Write a parsed table to the cache, skipping tables pyarrow cannot store (ex: mixed type columns)
+    param df: data frame
+    param cached: str, cache file path
+    '''
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    # write then rename so an interrupted run never leaves a partial cache file
+    tmp = cached + '.tmp'
+    try:
+        df.to_feather(tmp)
+    except Exception as e:
+        print(f"WARNING: not caching {cached}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    os.replace(tmp, cached)
+
+def write_table(df, path):
+    '''
+    Write a stage output, format chosen by extension (.feather, .parquet, .csv or Excel)
+    param df: data frame
+    param path: str, output file path
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.feather':
+        df.reset_index(drop=True).to_feather(path)
+    elif ext == '.parquet':
+        df.to_parquet(path, index=False)
+    elif ext == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        # streamed a chunk of rows at a time instead of building the workbook in memory
+        writer = stream.TableWriter(path)
+        writer.write('Sheet1', df, index=True)
+        writer.close()
+
+def write_tables(df, tables, path):
+    '''
+    Write a stage output and its summary tables in one pass. Excel outputs get one sheet per table;
+    other formats write each table next to the output as <name>_<table name><ext>.
+    param df: data frame, main output
+    param tables: dict of table name -> data frame
+    param path: str, output file path
+    '''
+    writer = stream.TableWriter(path, main='Links')
+    writer.write('Links', df, index=True)
+    for name, table in tables.items():
+        writer.write(name, table)
+    writer.close()
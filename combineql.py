@@ -4,88 +4,122 @@ import sys
 import pandas as pd
 import os
 import re 
+import validation
+import cache
+import stream
+import instrument
+import atlproj
+import schema
 
 def usage(exitcode=0): 
     progname = os.path.basename(sys.argv[0])
-    print(f'''Usage: {progname} -q Quotations.xlsx -l Links.xlsx -o output_data.xlsx []
-    -q quotations_data_path Quotations export from atlas ti project 
-    -l links_data_path      Links export from atlas ti project 
-    -o output_data_path     Output data file''')
+    print(f'''Usage: {progname} -q Quotations.xlsx -l Links.xlsx -o output_data.feather [-r report.csv -s chunk_rows]
+    -q quotations_data_path Quotations export from atlas ti project (or the .atlproj project itself) 
+    -l links_data_path      Links export from atlas ti project (or the .atlproj project itself) 
+    -o output_data_path     Output data file (.feather, .parquet, .csv or .xlsx), tables go on extra sheets or next to it
+    -r report_path          Validation report file (.csv, .parquet or .xlsx)
+    -s chunk_rows           Stream the links this many rows at a time
+{instrument.USAGE}''')
     sys.exit(exitcode)
 
-def error(message, df, index): 
+# integer document and reference # of the source and target, parsed from SID/TID ('3:17' -> 3, 17)
+ID_COLUMNS = ['Source Doc', 'Source Ref', 'Target Doc', 'Target Ref']
+
+def addIDColumns(ldf): 
     '''
-    Prints a message and a specified row of the data frame
-    param message: error message 
-    param df: data frame 
-    param index: row # in data frame with error 
+    Parse SID and TID once into integer document and reference # columns. 
+    Does nothing if the columns are already there. 
+    param ldf: links data frame 
+    return links data frame 
     '''
-    print(f"ERROR: {message}")
-    print(df.loc[[index]])
+    if all(col in ldf for col in ID_COLUMNS): 
+        return ldf 
+    # .str[i] rather than expand=True, which gives no columns at all for an empty frame 
+    sid = ldf['SID'].astype(str).str.split(':', n=1)
+    tid = ldf['TID'].astype(str).str.split(':', n=1)
+    ldf['Source Doc'], ldf['Source Ref'] = sid.str[0].astype(int), sid.str[1].astype(int)
+    ldf['Target Doc'], ldf['Target Ref'] = tid.str[0].astype(int), tid.str[1].astype(int)
+    return ldf 
+
+# relation: (source code, target code, target -> source links allowed)
+# a reversible link is swapped when the source has the target code and the target has the source code 
+RELATION_RULES = {
+    'Anaphor':  ('Antecedent', 'Anaphor',    False),
+    'Cataphor': ('Cataphor',   'Postcedent', False),
+    'Exophora': ('Exophora',   'Referent',   True),
+}
 
-def switchTargetSource(ldf, index): 
+def switchTargetSource(ldf, mask): 
     '''
     Change the source to the target and the target to the source. 
     param ldf: links data frame 
-    param index: row in data frame want to swap 
+    param mask: boolean series, True for rows want to swap 
     return links data frame 
     '''
-    if ldf['SID'][index].split(':')[0] > ldf['TID'][index].split(':')[0]: 
-        # save source in temp vars 
-        sid         = ldf['SID'][index]
-        source      = ldf['Source'][index] 
-        sourceCode  = ldf['Source Code'][index]
-        # set source to target 
-        ldf['SID'][index]           = ldf['TID'][index] 
-        ldf['Source'][index]        = ldf['Target'][index] 
-        ldf['Source Code'][index]   = ldf['Target Code'][index]
-        # set target to source 
-        ldf['TID'][index]           = sid
-        ldf['Target'][index]        = source
-        ldf['Target Code'][index]   = sourceCode
+    swap = mask & (ldf['Source Doc'] > ldf['Target Doc'])
+    validation.record('cannot-switch', "cannot switch source and target because sid <= tid", ldf, mask & ~swap, ['SID', 'TID'])
+    sourceCols = ['SID', 'Source', 'Source Code', 'Source Doc', 'Source Ref']
+    targetCols = ['TID', 'Target', 'Target Code', 'Target Doc', 'Target Ref']
+    if not swap.any(): 
         return ldf 
-    else: 
-        error("cannot switch source and target because sid <= tid", ldf, index)
+    # one column at a time so each column keeps its dtype 
+    for sourceCol, targetCol in zip(sourceCols, targetCols): 
+        source = ldf.loc[swap, sourceCol]
+        ldf.loc[swap, sourceCol] = ldf.loc[swap, targetCol]
+        ldf.loc[swap, targetCol] = source
+    return ldf 
+
+def hasCode(codes, code): 
+    '''
+    Checks which rows of a codes column include a code 
+    param codes: series of newline separated codes (ex: 'Antecedent\\nPostcedent') 
+    param code: str, code to look for (ex: 'Antecedent') 
+    return boolean series 
+    '''
+    return ('\n' + codes + '\n').str.contains('\n' + code + '\n', regex=False)
 
-def singularizeCode(ldf, code, codesList, colTitle, index): 
+def singularizeCode(ldf, code, rows, colTitle): 
     '''
     Each source/target should only have one code in the links data frame. 
-    This function takes a list of codes and the desired code and changes the dataframe 
-    so that the source/target only has one code in that row. 
+    This function takes the desired code and changes the dataframe 
+    so that the source/target only has that code in the given rows. 
     param ldf: links data frame 
     param code: str, Code that should be source/target (ex: 'Antecedent')
-    param codesList: list,  the list of codes (ex: sourceCodes) 
+    param rows: boolean series, the rows you are trying to singularize the codes on 
     param colTitle: str, the column holding the codes (ex: 'Source Code')
-    param index: int, the row in the data frame that you are trying to singularize the codes on 
-    return ldf 
+    return boolean series, rows that do not have the code 
     '''
-    if code in codesList: 
-        ldf[colTitle][index] = code
-    else: 
-        error("relation is {relation} but {code} not in {codesList}", ldf, index)
-    return ldf 
+    has = hasCode(ldf[colTitle], code) 
+    ldf.loc[rows & has, colTitle] = code
+    return rows & ~has 
+
+# ending punctuation left on quotation text by accident 
+BAD_PUNCT = ['!', '.', '?']
+PARTICIPANT_PATTERN = re.compile(r'participant([0-9]+)')
+
+def participantMismatches(ldf): 
+    '''
+    Find participant #s in the target text that do not match the target document 
+    (participant n's exophoras are in document 2n) 
+    param ldf: links data frame 
+    return index labels of the rows with a mismatch, once for every mismatching participant # 
+    '''
+    ps = ldf['Target'].str.strip().str.extractall(PARTICIPANT_PATTERN)[0].astype(int)
+    docNum = ldf['Target Doc'].reindex(ps.index.get_level_values(0)).to_numpy()
+    bad = (ps.to_numpy() * 2 != docNum) & (docNum % 2 == 0)
+    return list(ps.index.get_level_values(0)[bad])
 
 def cleanText(ldf): 
     '''
     Removes whitespace and accidental punctuation from text
     '''
-    for index in ldf.index:
-        # remove ending punctuation 
-        source = ldf['Source'][index].strip()
-        target = ldf['Target'][index].strip()
-        docNum = ldf['TID'][index].split(':')[0]
-        bad_punct = ['!','.','?']
-        if source[-1] in bad_punct: 
-            ldf['Source'][index] = source[:-1]
-        if target[-1] in bad_punct: 
-            ldf['Target'][index] = target[:-1]
-        # fix participant # 
-        reg = r'participant([0-9]+)'
-        ps = re.findall(reg, target)
-        if len(ps) > 0: 
-            for p in ps:
-                if int(p)*2 != int(docNum) and not int(docNum)%2: 
-                    error(f"participant # does not match text", ldf, index)
+    # remove ending punctuation 
+    for colTitle in ['Source', 'Target']: 
+        text = ldf[colTitle].str.strip()
+        ldf[colTitle] = ldf[colTitle].mask(text.str[-1].isin(BAD_PUNCT), text.str[:-1])
+
+    # check participant # 
+    validation.record('participant-mismatch', "participant # does not match text", ldf, participantMismatches(ldf), ['TID', 'Target'])
     return ldf
 
 def validateCodes(ldf): 
@@ -98,57 +132,66 @@ def validateCodes(ldf):
     param ldf: links data frame 
     return links data frame 
     '''
-    for index in ldf.index: 
-        sourceCodes = ldf['Source Code'][index].split('\n')
-        targetCodes = ldf['Target Code'][index].split('\n')
-        relation    = ldf['Relation'][index]
-        # only one code per source
-        if len(sourceCodes) > 1: 
-            if relation == 'Anaphor': 
-                ldf = singularizeCode(ldf, 'Antecedent', sourceCodes, 'Source Code', index)
-            elif relation == 'Cataphor': 
-                ldf = singularizeCode(ldf, 'Cataphor', sourceCodes, 'Source Code', index)
-            elif relation == 'Exophora': 
-                ldf = singularizeCode(ldf, 'Exophora', sourceCodes, 'Source Code', index)
-            else: 
-                error(f"{relation} not an accepted relation", ldf, index)
-        # only one code per target 
-        if len(targetCodes) > 1: 
-            if relation == 'Anaphor': 
-                ldf = singularizeCode(ldf, 'Anaphor', targetCodes, 'Target Code', index)
-            elif relation == 'Cataphor': 
-                ldf = singularizeCode(ldf, 'Postcedent', targetCodes, 'Target Code', index)
-            elif relation == 'Exophora': 
-                if 'Referent' in targetCodes: 
-                    ldf['Target Code'][index] = 'Referent'
-                else: 
-                    if ldf['Source Code'][index] == 'Referent' and 'Exophora' in targetCodes: 
-                        ldf['Target Code'][index] = 'Exophora'
-                        ldf = switchTargetSource(ldf, index) 
-                    else: 
-                         error(f"relation is {relation} but 'Referent' not in {targetCodes}", ldf, index) 
- 
-        counterparts = {'Antecedent':'Anaphor', 'Cataphor':'Postcedent', 'Exophora':'Referent'}
-        sourceCode = ldf['Source Code'][index]
-        targetCode = ldf['Target Code'][index]
-        if sourceCode not in counterparts:
-            if targetCode in counterparts: 
-                # check if target counterpart to source
-                if counterparts[targetCode] == sourceCode: 
-                    # if counterpart, then switch source and target 
-                    ldf = switchTargetSource(ldf, index) 
-                else:
-                    # if not counterparts, then error 
-                    error(f"{sourceCode} not a counterpart to {targetCode}", ldf, index)
-            else: 
-                error(f"neither {sourceCode} nor {targetCode} is an acceptable source", ldf, index)
-        else: # source is an accepted source 
-            # check if source -> target correct counterparts 
-            if counterparts[sourceCode] != targetCode: 
-                # if not, ERROR     
-                error(f"source {sourceCode} !-> target {targetCode}", ldf, index)
+    ldf['Source Code'] = ldf['Source Code'].astype(str)
+    ldf['Target Code'] = ldf['Target Code'].astype(str)
+    relation    = ldf['Relation']
+    multiSource = ldf['Source Code'].str.contains('\n', regex=False)
+    multiTarget = ldf['Target Code'].str.contains('\n', regex=False)
+
+    # only one code per source
+    validation.record('unknown-relation', "not an accepted relation", ldf, multiSource & ~relation.isin(list(RELATION_RULES)), ['SID', 'TID', 'Relation'])
+    for rel, (sourceCode, targetCode, reversible) in RELATION_RULES.items(): 
+        missing = singularizeCode(ldf, sourceCode, multiSource & (relation == rel), 'Source Code')
+        validation.record('source-code-missing', f"relation is {rel} but {sourceCode} not in source codes", ldf, missing, ['SID', 'Relation', 'TID', 'Source Code', 'Target Code'])
+
+    # only one code per target 
+    reverse = pd.Series(False, index=ldf.index)
+    for rel, (sourceCode, targetCode, reversible) in RELATION_RULES.items(): 
+        missing = singularizeCode(ldf, targetCode, multiTarget & (relation == rel), 'Target Code')
+        if reversible: 
+            backwards = missing & (ldf['Source Code'] == targetCode) & hasCode(ldf['Target Code'], sourceCode)
+            ldf.loc[backwards, 'Target Code'] = sourceCode
+            reverse |= backwards
+            missing &= ~backwards
+        validation.record('target-code-missing', f"relation is {rel} but {targetCode} not in target codes", ldf, missing, ['SID', 'Relation', 'TID', 'Source Code', 'Target Code'])
+    ldf = switchTargetSource(ldf, reverse)
+
+    counterparts = {sourceCode: targetCode for sourceCode, targetCode, _ in RELATION_RULES.values()}
+    sourceCode  = ldf['Source Code']
+    targetCode  = ldf['Target Code']
+    validSource = sourceCode.isin(list(counterparts))
+    validTarget = targetCode.isin(list(counterparts))
+    # if target counterpart to source, then switch source and target 
+    counterpart = ~validSource & validTarget & (targetCode.map(counterparts) == sourceCode)
+    validation.record('not-counterpart', "source not a counterpart to target", ldf, ~validSource & validTarget & ~counterpart, ['SID', 'Relation', 'TID', 'Source Code', 'Target Code'])
+    validation.record('no-acceptable-source', "neither source nor target is an acceptable source", ldf, ~validSource & ~validTarget, ['SID', 'Relation', 'TID', 'Source Code', 'Target Code'])
+    # source is an accepted source, check if source -> target correct counterparts 
+    validation.record('wrong-target', "source !-> target", ldf, validSource & (sourceCode.map(counterparts) != targetCode), ['SID', 'Relation', 'TID', 'Source Code', 'Target Code'])
+    ldf = switchTargetSource(ldf, counterpart)
     return ldf 
 
+def reportMissingIDs(ldf, ids, kind): 
+    '''
+    Records every links row whose SID or TID has no quotation, all at once 
+    param ldf: links data frame 
+    param ids: index of quotation IDs 
+    param kind: str, what was being looked up (ex: 'code') 
+    '''
+    missing = ~ldf['SID'].isin(ids) | ~ldf['TID'].isin(ids)
+    validation.record(f'missing-{kind}', f"no {kind} for link, SID/TID not in quotations", ldf, missing, ['SID', 'TID'])
+
+def quotationLookup(qdf, colTitle): 
+    '''
+    Series mapping each quotation ID to one of its columns ({1:5 : Antecedent, 1:6 : Anaphor...}) 
+    param qdf: quotations data frame or lookup from quotationIndex 
+    param colTitle: str, column to look up (ex: 'Codes') 
+    return series indexed by ID 
+    '''
+    if qdf.index.name == 'ID': # already a lookup from quotationIndex 
+        return qdf[colTitle]
+    # last row wins for repeated IDs, like building a dict from the rows 
+    return qdf.drop_duplicates('ID', keep='last').set_index('ID')[colTitle]
+
 def addCodes(ldf, qdf): 
     '''
     Add the code for each source and target to the links data frame 
@@ -156,19 +199,14 @@ def addCodes(ldf, qdf):
     parm qdf: quotaitons data frame 
     return links dataframe 
     '''
+    codes = quotationLookup(qdf, 'Codes')
+    reportMissingIDs(ldf, codes.index, 'code')
+
     # add Source Codes col 
-    ldf.insert(loc=2, column='Source Code', value="")
+    ldf.insert(loc=ldf.columns.get_loc('Source') + 1, column='Source Code', value=ldf['SID'].map(codes).fillna(""))
     
     # add Target Codes col 
-    ldf['Target Code'] = ""
-   
-    # create dictionary with IDs as keys and codes as values ({1:5 : Antecedant, 1:6 : Anaphor...})
-    codes = {row[0]: row[5] for row in qdf.values}
-    
-    # add codes to both source and target in links df 
-    for index in ldf.index: 
-        ldf['Source Code'][index] = codes[ldf['SID'][index]]
-        ldf['Target Code'][index] = codes[ldf['TID'][index]]
+    ldf.insert(loc=ldf.columns.get_loc('Target') + 1, column='Target Code', value=ldf['TID'].map(codes).fillna(""))
 
     return ldf 
 
@@ -179,32 +217,18 @@ def addLines(ldf, qdf):
     parm qdf: quotaitons data frame 
     return links dataframe 
     '''
-    # add Source Codes col 
-    ldf.insert(loc=3, column='Source Line', value="")
-    
-    # add Target Codes col 
-    ldf['Target Line'] = ""
-   
-    # create dictionary with IDs as keys and lines as values ({1:5 : Antecedant, 1:6 : Anaphor...})
-    lines = {row[0]: row[6] for row in qdf.values}
+    lines = quotationLookup(qdf, 'Line #')
+    reportMissingIDs(ldf, lines.index, 'line')
+    # missing lines are left NaN so later stages skip them 
+
+    # add Source Lines col 
+    ldf.insert(loc=ldf.columns.get_loc('Source Code') + 1, column='Source Line', value=ldf['SID'].map(lines))
     
-    # add lines to both source and target in links df 
-    for index in ldf.index: 
-        ldf['Source Line'][index] = lines[ldf['SID'][index]]
-        ldf['Target Line'][index] = lines[ldf['TID'][index]]
+    # add Target Lines col 
+    ldf.insert(loc=ldf.columns.get_loc('Target Code') + 1, column='Target Line', value=ldf['TID'].map(lines))
 
     return ldf 
 
-def changeLineNumFormat(qdf): 
-    ''' 
-    The line num format is currently '62 - 62'
-    Change this to just be '62'
-    param: quotations dataframe 
-    return quotations dadtaframe 
-    '''
-    qdf['Line #'] = [l.split()[0] for l in qdf['Line #']]    
-    return qdf 
-
 def removeP1Comments(qdf): 
     '''
     When I first started annotating, I commented every exophora for participant01. 
@@ -216,9 +240,121 @@ def removeP1Comments(qdf):
     qdf.loc[(qdf.Document == 'participant01'), 'Comment']=''
     return qdf
 
+def tidyQuotations(qdf): 
+    '''
+    Tidy up a Quotation Manager export for combining 
+    param qdf: quotations data frame with the quotations schema applied (Reference is already one line number) 
+    return quotations data frame 
+    '''
+    # delete unneeded cols 
+    qdf = qdf.drop(columns='Document Groups')
+
+    # rename cols 
+    qdf = qdf.rename(columns={'Reference':'Line #'})
+
+    # remove unneeded comments 
+    qdf = removeP1Comments(qdf)
+    return qdf 
+
+def tidyLinks(ldf): 
+    '''
+    Tidy up a Hyperlink Manager (links) export for combining 
+    param ldf: links data frame 
+    return links data frame 
+    '''
+    # delete unneeded cols 
+    ldf = ldf.drop(columns='Unnamed: 2')
+
+    # rename cols 
+    ldf = ldf.rename(columns={'ID':'SID', 'ID.1':'TID'})
+
+    # parse document and reference #s 
+    ldf = addIDColumns(ldf)
+    return ldf 
+
+def loadQuotations(path): 
+    '''
+    Read a Quotation Manager export (or a project archive), check its column types and tidy it up for combining 
+    param path: str, quotations export path 
+    return quotations data frame 
+    '''
+    return tidyQuotations(instrument.run('readQuotations', schema.load, path, 'quotations'))
+
+def loadLinks(path): 
+    '''
+    Read a Hyperlink Manager (links) export (or a project archive), check its column types and tidy it up for combining 
+    param path: str, links export path 
+    return links data frame 
+    '''
+    return tidyLinks(instrument.run('readLinks', schema.load, path, 'links'))
+
+def loadInputs(quotations_data_path, links_data_path): 
+    '''
+    Read the quotations and links exports at the same time (see schema.load_all) and tidy them up for combining 
+    param quotations_data_path: str, quotations export path 
+    param links_data_path: str, links export path 
+    return (quotations data frame, links data frame) 
+    '''
+    frames = instrument.run('readExports', schema.load_all, {'quotations': quotations_data_path, 'links': links_data_path})
+    return tidyQuotations(frames['quotations']), tidyLinks(frames['links'])
+
+def quotationIndex(path, chunk_rows): 
+    '''
+    Read a Quotation Manager export in chunks, keeping only the code and line of each quotation 
+    param path: str, quotations export path 
+    param chunk_rows: int, rows per chunk 
+    return data frame of Codes and Line # indexed by ID 
+    '''
+    chunks = [tidyQuotations(schema.apply_schema(qdf, 'quotations', path))[['ID', 'Codes', 'Line #']] for qdf in stream.iter_table(path, chunk_rows)]
+    qdf = pd.concat(chunks, ignore_index=True)
+    # last row wins for repeated IDs, like building a dict from the rows 
+    return qdf.drop_duplicates('ID', keep='last').set_index('ID')
+
+def combine(ldf, qdf): 
+    '''
+    Add quotation codes and lines to the links and clean them up 
+    param ldf: links data frame 
+    param qdf: quotations data frame 
+    return links data frame 
+    '''
+    # add quote codes to links 
+    ldf = instrument.run('addCodes', addCodes, ldf, qdf)
+
+    # validate codes 
+    ldf = instrument.run('validateCodes', validateCodes, ldf)
+
+    # clean text 
+    ldf = instrument.run('cleanText', cleanText, ldf)
+    
+    # add line numbers 
+    ldf = instrument.run('addLines', addLines, ldf, qdf)
+
+    # keep the parsed ID columns after the exported ones 
+    ldf = ldf[[col for col in ldf.columns if col not in ID_COLUMNS] + ID_COLUMNS]
+    return ldf 
+
+def combineStream(quotations_data_path, links_data_path, output_data_path, chunk_rows): 
+    '''
+    Combine quotations and links a chunk of links at a time, writing each chunk as it is done. 
+    Only the quotation codes and lines are kept in memory for the whole run. 
+    The validation issues are written after the links, as an extra sheet (or file) like combining in one go. 
+    param quotations_data_path: str, quotations export path 
+    param links_data_path: str, links export path 
+    param output_data_path: str, output file path 
+    param chunk_rows: int, links per chunk 
+    '''
+    qdf = quotationIndex(quotations_data_path, chunk_rows)
+    writer = stream.TableWriter(output_data_path, main='Links')
+    for ldf in stream.iter_table(links_data_path, chunk_rows): 
+        writer.append('Links', combine(tidyLinks(ldf), qdf), index=True)
+    writer.write('Validation', validation.report())
+    writer.close()
+
 def main(): 
     # command line parsing 
     arguments = sys.argv[1:]
+    report_path = None
+    chunk_rows = None
     if len(arguments) < 6: 
         usage(0)
     while arguments and arguments[0].startswith('-'):
@@ -229,6 +365,12 @@ def main():
             links_data_path = arguments.pop(0)
         elif argument == '-o':
             output_data_path = arguments.pop(0)
+        elif argument == '-r':
+            report_path = arguments.pop(0)
+        elif argument == '-s':
+            chunk_rows = int(arguments.pop(0))
+        elif instrument.option(argument, arguments):
+            pass
         elif argument == '-h':
             usage(0)
         else:
@@ -238,42 +380,26 @@ def main():
     if not os.path.exists(quotations_data_path) or not os.path.exists(links_data_path):
         usage(1)
 
-    # create data frames 
-    qdf = pd.DataFrame() 
-    qdf = qdf.append(pd.read_excel(quotations_data_path), ignore_index=True)
-    ldf = pd.DataFrame() 
-    ldf = ldf.append(pd.read_excel(links_data_path), ignore_index=True)
-    
-    # delete unneeded cols 
-    qdf = qdf.drop('Document Groups', 1)
-    ldf = ldf.drop('Unnamed: 2',1)
-
-    # rename cols 
-    qdf = qdf.rename(columns={'Reference':'Line #'})
-    ldf = ldf.rename(columns={'ID':'SID', 'ID.1':'TID'})
-   
-    # remove unneeded comments 
-    qdf = removeP1Comments(qdf)
-
-    # change line number strange formating to one number 
-    qdf = changeLineNumFormat(qdf)
-
-    # add quote codes to links 
-    ldf = addCodes(ldf,qdf)
+    # a project archive is read whole, so it is combined in one go 
+    if chunk_rows and not atlproj.is_project(quotations_data_path) and not atlproj.is_project(links_data_path): 
+        # combine and export a chunk at a time 
+        combineStream(quotations_data_path, links_data_path, output_data_path, chunk_rows)
+    else: 
+        # create data frames 
+        qdf, ldf = loadInputs(quotations_data_path, links_data_path)
 
-    # validate codes 
-    ldf = validateCodes(ldf)
+        # combine quotations and links 
+        ldf = combine(ldf, qdf)
 
-    # clean text 
-    ldf = cleanText(ldf)
-    
-    # add line numbers 
-    ldf = addLines(ldf,qdf)
+        # export to output file, with the validation issues as an extra sheet 
+        print(ldf)
+        instrument.run('writeTables', cache.write_tables, ldf, {'Validation': validation.report()}, output_data_path)
 
-    # export to output file
-    print(ldf)
-    #qdf.to_excel(f"{output_data_path}")
-    ldf.to_excel(f"{output_data_path}")
+    # report validation issues 
+    validation.print_summary()
+    if report_path: 
+        validation.write_report(report_path)
+    instrument.finish()
 
 if __name__ == '__main__': 
     main() 
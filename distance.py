@@ -2,48 +2,35 @@
 
 import sys 
 import pandas as pd
+import numpy as np
 import os
 import re 
+import validation
+import cache
+import combineql
+import instrument
 
 def usage(exitcode=0): 
     progname = os.path.basename(sys.argv[0])
-    print(f'''Usage: {progname} -i input_data.xlsx -o output_data.xlsx []
+    print(f'''Usage: {progname} -i input_data.feather -o output_data.feather [-r report.csv -s stats.csv]
     -i input_data_path      Output from combineql.py
-    -o output_data_path     Output data file''')
+    -o output_data_path     Output data file (.feather, .parquet, .csv or .xlsx), tables go on extra sheets or next to it
+    -s stats_path           Distance statistics file, the histogram goes next to it as stats_histogram
+    -r report_path          Validation report file (.csv, .parquet or .xlsx)
+{instrument.USAGE}''')
     sys.exit(exitcode)
 
-def error(message, df, index): 
-    '''
-    Prints a message and a specified row of the data frame
-    param message: error message 
-    param df: data frame 
-    param index: row # in data frame with error 
-    '''
-    print(f"ERROR: {message}")
-    print(df.loc[[index]])
-
 def addRefDiffs(df): 
     '''
-    Adds columsn to the data frame with the difference between the source reference # and the target reference # 
+    Adds columns to the data frame with the difference between the source reference # and the target reference # 
     but only for cataphor and anaphor 
     '''
-    df['Ref Diff'] = ""
-    df['Anaphora Ref Diff'] = "" 
-    df['Cataphora Ref Diff'] = "" 
-    for index in df.index: 
-        if df['Target Code'][index] != 'Referent':
-            sourceRef = df['SID'][index].split(':')[1]
-            targetRef = df['TID'][index].split(':')[1]
-            refDiff = int(targetRef) - int(sourceRef)
-            if refDiff < 0: 
-                error(f"refDiff: {refDiff}", df, index)
-            df['Ref Diff'][index] = refDiff
-            if df['Relation'][index] == 'Anaphor': 
-                df['Anaphora Ref Diff'][index] = refDiff 
-            elif df['Relation'][index] == 'Cataphor': 
-                df['Cataphora Ref Diff'][index] = refDiff 
-        
-    #df.loc[df['Target Code'] != 'Referent', 'Ref Diff'] = df['TID'].split(':')[1] - df['SID'].split(':')[1]
+    df = combineql.addIDColumns(df)
+    refDiff = (df['Target Ref'] - df['Source Ref']).where(df['Target Code'] != 'Referent')
+    validation.record('negative-ref-diff', "target reference # before source reference #", df, refDiff < 0, ['SID', 'TID', 'Relation'])
+    df['Ref Diff'] = refDiff
+    df['Anaphora Ref Diff'] = refDiff.where(df['Relation'] == 'Anaphor')
+    df['Cataphora Ref Diff'] = refDiff.where(df['Relation'] == 'Cataphor')
     return df 
 
 def addLineDiffs(df): 
@@ -57,36 +44,103 @@ def addLineDiffs(df):
 
     return df
 
-def calcRefMean(df, colTitle): 
-    numRows = 0 
-    refSum = 0 
-    for row in df[colTitle]:
-        if type(row) == int: 
-            numRows += 1 
-            refSum += row 
-    print(f"numRows: {numRows}, refSum: {refSum}")
-    average = refSum/numRows 
-    return average 
-        
-
-def calcLineMeans(df): 
+# distance bins for the histogram, the left edge is included (2-4 is 2 <= distance < 5)
+HIST_EDGES  = [-np.inf, 0, 1, 2, 5, 10, 20, 50, 100, np.inf]
+HIST_LABELS = ['<0', '0', '1', '2-4', '5-9', '10-19', '20-49', '50-99', '100+']
+
+def distances(df): 
     '''
-    Calculate the average distance between source and target 
+    Long table of every line and reference # distance between a source and a non-Referent target 
+    param df: data frame with Line Diff and Ref Diff columns 
+    return data frame with Measure, Relation, Document and Distance columns 
     '''
-    print(f"Line Difference Mean: {df['Line Diff'].mean()}")
-    print(f"Anaphor Line Difference Mean: {df['Anaphor Line Diff'].mean()}")
-    print(f"Cataphor Line Difference Mean: {df['Cataphor Line Diff'].mean()}")
-    refAvg = calcRefMean(df, 'Ref Diff')
-    print(f"Reference Number Difference Mean: {refAvg}")
-    anaRefAvg = calcRefMean(df, 'Anaphora Ref Diff')
-    print(f"Anaphora Reference Number Difference Mean: {anaRefAvg}")
-    catRefAvg = calcRefMean(df, 'Cataphora Ref Diff')
-    print(f"Cataphora Reference Number Difference Mean: {catRefAvg}")
+    df = combineql.addIDColumns(df)
+    rows = df['Target Code'] != 'Referent'
+    n = int(rows.sum())
+    return pd.DataFrame({
+        'Measure':  np.repeat(['Line Diff', 'Ref Diff'], n),
+        'Relation': np.tile(df.loc[rows, 'Relation'].to_numpy(), 2),
+        'Document': np.tile(df.loc[rows, 'Source Doc'].to_numpy(), 2),
+        'Distance': np.concatenate([df.loc[rows, 'Line Diff'].to_numpy(float), df.loc[rows, 'Ref Diff'].to_numpy(float)]),
+    }).dropna(subset=['Distance'])
 
+def distanceStats(df): 
+    '''
+    Summary statistics of the line and reference # distances, overall, per relation and per relation and document 
+    param df: data frame with Line Diff and Ref Diff columns 
+    return data frame with one row per Measure, Relation, Document ('All' where not split) 
+    '''
+    long = distances(df)
+    tables = []
+    for keys in (['Measure'], ['Measure', 'Relation'], ['Measure', 'Relation', 'Document']): 
+        grouped = long.groupby(keys)['Distance']
+        stats = grouped.agg(['count', 'mean', 'median', 'max'])
+        # reindex so the quantile columns are there even without any distances 
+        quantiles = grouped.quantile([0.25, 0.75, 0.9]).unstack().reindex(columns=[0.25, 0.75, 0.9])
+        quantiles.columns = ['p25', 'p75', 'p90']
+        stats = stats.join(quantiles).reset_index()
+        for key in ('Relation', 'Document'): 
+            if key not in stats: 
+                stats[key] = 'All'
+        # document #s as text so the column holds one type next to 'All' (columnar formats need that) 
+        stats['Document'] = stats['Document'].astype(str)
+        tables.append(stats)
+    stats = pd.concat(tables, ignore_index=True)
+    stats = stats.rename(columns={'count': 'Count', 'mean': 'Mean', 'median': 'Median', 'max': 'Max', 'p25': 'P25', 'p75': 'P75', 'p90': 'P90'})
+    return stats[['Measure', 'Relation', 'Document', 'Count', 'Mean', 'Median', 'P25', 'P75', 'P90', 'Max']]
+
+def distanceHistogram(df): 
+    '''
+    Number of links in each distance bin, overall, per relation and per relation and document 
+    param df: data frame with Line Diff and Ref Diff columns 
+    return data frame with one row per Measure, Relation, Document ('All' where not split), one column per bin 
+    '''
+    long = distances(df)
+    if long.empty: 
+        # crosstab repeats the bin columns when there are no rows 
+        return pd.DataFrame(columns=['Measure', 'Relation', 'Document'] + HIST_LABELS)
+    long['Bin'] = pd.cut(long['Distance'], HIST_EDGES, right=False, labels=HIST_LABELS)
+    # bin counts per measure, relation and document, the coarser rows are sums of these 
+    counts = pd.crosstab([long['Measure'], long['Relation'], long['Document']], long['Bin'])
+    counts = counts.reindex(columns=HIST_LABELS, fill_value=0)
+    tables = []
+    for keys in (['Measure'], ['Measure', 'Relation'], ['Measure', 'Relation', 'Document']): 
+        hist = counts.groupby(level=keys, observed=True).sum().reset_index()
+        for key in ('Relation', 'Document'): 
+            if key not in hist: 
+                hist[key] = 'All'
+        # document #s as text, as in distanceStats 
+        hist['Document'] = hist['Document'].astype(str)
+        tables.append(hist)
+    hist = pd.concat(tables, ignore_index=True)
+    hist.columns.name = None
+    return hist[['Measure', 'Relation', 'Document'] + HIST_LABELS]
+
+def printStats(stats): 
+    '''
+    Prints the overall and per relation distance statistics 
+    param stats: data frame from distanceStats 
+    '''
+    print(stats[stats['Document'] == 'All'].to_string(index=False))
+
+def addDistances(df): 
+    '''
+    Adds the line and reference # distance columns 
+    param df: combined links data frame (output from combineql.py) 
+    return data frame 
+    '''
+    # add line diff cols 
+    df = instrument.run('addLineDiffs', addLineDiffs, df)
+    
+    # add ref # diff cols 
+    df = instrument.run('addRefDiffs', addRefDiffs, df)
+    return df 
 
 def main(): 
     # command line parsing 
     arguments = sys.argv[1:]
+    report_path = None
+    stats_path = None
     if len(arguments) < 4: 
         usage(0)
     while arguments and arguments[0].startswith('-'):
@@ -95,6 +149,12 @@ def main():
             input_data_path = arguments.pop(0)
         elif argument == '-o':
             output_data_path = arguments.pop(0)
+        elif argument == '-r':
+            report_path = arguments.pop(0)
+        elif argument == '-s':
+            stats_path = arguments.pop(0)
+        elif instrument.option(argument, arguments):
+            pass
         elif argument == '-h':
             usage(0)
         else:
@@ -105,21 +165,29 @@ def main():
         usage(1)
 
     # create data frames 
-    df = pd.DataFrame() 
-    df = df.append(pd.read_excel(input_data_path), ignore_index=True)
+    df = instrument.run('readTable', cache.read_table, input_data_path)
     
-    # add line diff cols 
-    df = addLineDiffs(df)
-    
-    # add ref # diff cols 
-    df = addRefDiffs(df)
-    
-    # calculate line diff averages 
-    calcLineMeans(df)
+    # add distances 
+    df = addDistances(df)
+
+    # print and export statistics 
+    tables = {'Distance Stats': instrument.run('distanceStats', distanceStats, df), 'Distance Histogram': instrument.run('distanceHistogram', distanceHistogram, df)}
+    printStats(tables['Distance Stats'])
+    if stats_path: 
+        cache.write_table(tables['Distance Stats'], stats_path)
+        base, ext = os.path.splitext(stats_path)
+        cache.write_table(tables['Distance Histogram'], f"{base}_histogram{ext}")
 
-    # export to output file
+    # export to output file, with the statistics and validation issues as extra sheets 
     print(df)
-    df.to_excel(f"{output_data_path}")
+    tables['Validation'] = validation.report()
+    instrument.run('writeTables', cache.write_tables, df, tables, output_data_path)
+
+    # report validation issues 
+    validation.print_summary()
+    if report_path: 
+        validation.write_report(report_path)
+    instrument.finish()
 
 if __name__ == '__main__': 
     main() 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+'''
+Per-stage instrumentation for the pipeline scripts. When enabled (--profile), every stage
+run through instrument.run records its wall time, CPU time, peak RSS growth, rows in and out
+and the number of validation issues it found. One stage can also be run under cProfile.
+When disabled, instrument.run only calls the stage.
+'''
+
+import os
+import sys
+import json
+import time
+import pandas as pd
+import validation
+
+try:
+    import resource
+except ImportError: # not available on Windows, peak RSS is then not recorded
+    resource = None
+
+PROFILE_COLUMNS = ['Stage', 'Calls', 'Wall s', 'CPU s', 'Peak RSS MB', 'Rows In', 'Rows Out', 'Issues']
+
+# usage lines for the options handled by instrument.option
+USAGE = '''    --profile                Print the time, memory, rows and issues of every stage
+    --profile-out profile_path Also write them to a file (.json or .csv)
+    --profile-stage stage    Run one stage under cProfile (ex: validateCodes)'''
+
+enabled = False
+profile_stage = None
+profile_path = None
+records = []
+
+def enable(stage=None):
+    '''
+    Start recording stages
+    param stage: str, name of a stage to also run under cProfile, None for none
+    '''
+    global enabled, profile_stage
+    enabled = True
+    profile_stage = stage
+
+def option(argument, arguments):
+    '''
+    Handle a profiling command line option
+    param argument: str, option being parsed
+    param arguments: list, remaining command line arguments, the option's value is popped from it
+    return True if the option was a profiling option
+    '''
+    global profile_path
+    if argument == '--profile':
+        enable(profile_stage)
+    elif argument == '--profile-out':
+        profile_path = arguments.pop(0)
+        enable(profile_stage)
+    elif argument == '--profile-stage':
+        enable(arguments.pop(0))
+    else:
+        return False
+    return True
+
+def finish():
+    '''
+    Print the recorded stages, and write them if a profile path was given
+    '''
+    if not enabled:
+        return
+    print_summary()
+    if profile_path:
+        write(profile_path)
+
+def clear():
+    '''
+    Forget all recorded stages
+    '''
+    records.clear()
+
+def peak_rss():
+    '''
+    return float, peak resident set size of this process so far in MB, None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def rows(value):
+    '''
+    return int, rows of a data frame (or of the first item of a tuple), None for anything else
+    '''
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+def issue_count():
+    '''
+    return int, validation issues recorded so far
+    '''
+    return sum(len(issue) for issue in validation.issues)
+
+def run(name, func, *args, **kwargs):
+    '''
+    Run one stage, recording it when instrumentation is enabled
+    param name: str, stage name (ex: 'validateCodes')
+    param func: function running the stage
+    param args: positional arguments of func, rows in are counted on the first one
+    param kwargs: keyword arguments of func
+    return whatever func returns
+    '''
+    if not enabled:
+        return func(*args, **kwargs)
+    issues = issue_count()
+    rss = peak_rss()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    if name == profile_stage:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        print(f"Profile of {name}")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+    else:
+        result = func(*args, **kwargs)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    records.append({
+        'Stage': name,
+        'Wall s': wall,
+        'CPU s': cpu,
+        'Peak RSS MB': None if rss is None else peak_rss() - rss,
+        'Rows In': rows(args[0]) if args else None,
+        'Rows Out': rows(result),
+        # issue lists are cleared and restored around per-document runs
+        'Issues': max(issue_count() - issues, 0),
+    })
+    return result
+
+def collect(func, *args):
+    '''
+    Run a function and return the stages it recorded with its result, so stages run in
+    worker processes can be sent back to the parent
+    param func: function
+    param args: arguments of func
+    return (result, list of stage records)
+    '''
+    clear()
+    return func(*args), list(records)
+
+def summary():
+    '''
+    return data frame with one row per stage name, repeated stages are added up
+    '''
+    if not records:
+        return pd.DataFrame(columns=PROFILE_COLUMNS)
+    rdf = pd.DataFrame(records)
+    grouped = rdf.groupby('Stage', sort=False)
+    sdf = grouped.sum(min_count=1)
+    sdf.insert(0, 'Calls', grouped.size())
+    # peak growth does not add up across calls, keep the largest
+    sdf['Peak RSS MB'] = grouped['Peak RSS MB'].max()
+    sdf[['Rows In', 'Rows Out']] = sdf[['Rows In', 'Rows Out']].astype('Int64')
+    return sdf.reset_index()[PROFILE_COLUMNS]
+
+def print_summary():
+    '''
+    Prints the recorded stages as a table
+    '''
+    print("Profile")
+    print(summary().to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+def write(path):
+    '''
+    Writes every recorded stage, format chosen by extension (.json or .csv)
+    param path: str, profile file path
+    '''
+    if os.path.splitext(path)[1].lower() == '.csv':
+        summary().to_csv(path, index=False)
+        return
+    sdf = summary()
+    sdf = sdf.astype(object).where(sdf.notna(), None)
+    with open(path, 'w') as f:
+        json.dump({'stages': sdf.to_dict('records'), 'calls': records}, f, indent=2)
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import combineql
+import distance
+import percentage
+import validation
+import cache
+import instrument
+import query
+import numpy as np
+import pandas as pd
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+# bump when a change to the stages changes their results, so kept per-document results are recomputed
+STATE_VERSION = 7
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} query -i output_data.feather [query options, see query.py -h]
+       {progname} run -q Quotations.xlsx -l Links.xlsx -o output_data.feather [-d participant_files_dir/ -c combined.feather -t distance.feather -r report.csv -j jobs --full]
+    -q quotations_data_path  Quotations export from atlas ti project (or the .atlproj project itself)
+    -l links_data_path       Links export from atlas ti project (or the .atlproj project itself)
+    -o output_data_path      Output data file (.feather, .parquet, .csv or .xlsx), tables go on extra sheets or next to it
+    -d participant_files_dir path to participant files, speaker counts are skipped without it
+    -c combined_data_path    Also write the combineql.py output here
+    -t distance_data_path    Also write the distance.py output here
+    -r report_path           Validation report file (.csv, .parquet or .xlsx)
+    -j, --jobs jobs          Process documents in parallel with this many processes
+    --full                   Reprocess every document, not only the ones that changed since the last run
+{instrument.USAGE}''')
+    sys.exit(exitcode)
+
+def runBatch(ldf, qdf, participant_files_path):
+    '''
+    Runs the per-link work of every stage on the links of one or more whole documents
+    param ldf: links data frame for some documents
+    param qdf: quotations data frame (at least the quotations the links use)
+    param participant_files_path: str, path to participant files, None to skip speaker counts
+    return (links data frame with distances and speakers, combined column names, validation issues)
+    '''
+    validation.clear()
+    df = combineql.combine(ldf, qdf)
+    combinedColumns = list(df.columns)
+    df = instrument.run('addLineDiffs', distance.addLineDiffs, df)
+    df = instrument.run('addRefDiffs', distance.addRefDiffs, df)
+    if participant_files_path:
+        df = instrument.run('add_speakers', percentage.add_speakers, df, participant_files_path)
+    return df, combinedColumns, validation.report()
+
+def quotationGroups(qdf):
+    '''
+    Row positions of each document's quotations, found in one pass over the quotations
+    param qdf: quotations data frame
+    return dict of document number (the part of ID before ':') -> array of row positions
+    '''
+    docs = pd.to_numeric(qdf['ID'].astype(str).str.extract(r'^([^:]*)', expand=False), errors='coerce')
+    return docs.groupby(docs).indices
+
+def batchQuotations(ldf, qdf, groups):
+    '''
+    Quotations of every document the links use as a source or target, in their original order
+    param ldf: links data frame
+    param qdf: quotations data frame
+    param groups: dict from quotationGroups
+    return quotations data frame
+    '''
+    docs = pd.unique(pd.concat([ldf['Source Doc'], ldf['Target Doc']]))
+    rows = [groups[doc] for doc in docs if doc in groups]
+    return qdf.iloc[np.sort(np.concatenate(rows))] if rows else qdf.iloc[:0]
+
+def batchDocuments(sizes, jobs):
+    '''
+    Split documents into at most jobs batches with about the same number of links, keeping their order
+    param sizes: series, number of links of each document, indexed by document number
+    param jobs: int, number of batches wanted
+    return list of lists of document numbers
+    '''
+    start = sizes.cumsum() - sizes
+    batch = start * jobs // max(int(sizes.sum()), 1)
+    return [list(docs.index) for _, docs in sizes.groupby(batch.to_numpy(), sort=True)]
+
+def participantStamp(participant_files_path, doc):
+    '''
+    return str, size and modification time of a participant file, empty if it is not there
+    '''
+    path = participant_files_path + percentage.participant_filename(doc)
+    if not os.path.exists(path):
+        return ''
+    stat = os.stat(path)
+    return f"{stat.st_size}|{stat.st_mtime_ns}"
+
+def documentHashes(ldf, qdf, groups, participant_files_path):
+    '''
+    Content hash of everything each document's results depend on: its links rows, the quotations
+    of the documents they use and the participant files they are looked up in. Each table is hashed
+    in one pass and the row hashes are then grouped by document. Row labels are left out, so links
+    added or removed in another document do not change the hash.
+    param ldf: links data frame
+    param qdf: quotations data frame
+    param groups: dict from quotationGroups
+    param participant_files_path: str, path to participant files, None if speaker counts are skipped
+    return dict of document number -> hex digest
+    '''
+    linkRows = pd.util.hash_pandas_object(ldf, index=False).to_numpy()
+    quoteRows = pd.util.hash_pandas_object(qdf, index=False).to_numpy()
+    quoteHashes = {doc: hashlib.sha1(quoteRows[rows].tobytes()).hexdigest() for doc, rows in groups.items()}
+    stamps = {}
+    header = f"{STATE_VERSION}|{participant_files_path}|{list(ldf.columns)}|{list(qdf.columns)}".encode()
+    sources, targets = ldf['Source Doc'].to_numpy(), ldf['Target Doc'].to_numpy()
+    hashes = {}
+    for doc, rows in ldf.groupby('Source Doc', sort=False).indices.items():
+        h = hashlib.sha1(header)
+        h.update(linkRows[rows].tobytes())
+        used = np.unique(np.concatenate([sources[rows], targets[rows]]))
+        for other in used:
+            h.update(f"|{other}:{quoteHashes.get(other)}".encode())
+        if participant_files_path:
+            for participant in np.unique((used + 1) // 2):
+                if participant not in stamps:
+                    stamps[participant] = participantStamp(participant_files_path, participant)
+                h.update(f"|{participant}:{stamps[participant]}".encode())
+        hashes[doc] = h.hexdigest()
+    return hashes
+
+def runDocuments(ldf, qdf, participant_files_path, jobs=1, state_dir=None, full=False):
+    '''
+    Splits the links by document (Source Doc, the part of SID before ':') and runs the documents
+    in one batch, or in one batch per process when jobs > 1. Results are merged back in the original row order.
+    With a state directory, the results are saved with each document's content hash and
+    only documents whose hash changed since the last run are processed again.
+    param ldf: links data frame
+    param qdf: quotations data frame
+    param participant_files_path: str, path to participant files, None to skip speaker counts
+    param jobs: int, number of worker processes
+    param state_dir: str, where the results are kept between runs, None to not keep them
+    param full: bool, process every document even if it has not changed
+    return (links data frame with distances and speakers, combined column names)
+    '''
+    docs = ldf['Source Doc']
+    sizes = docs.value_counts(sort=False).reindex(pd.unique(docs))
+    # split the quotations once, each batch gets the quotations of the documents its links use
+    groups = quotationGroups(qdf)
+
+    results = []
+    todo = list(sizes.index)
+    saved = None
+    if state_dir:
+        hashes = instrument.run('documentHashes', documentHashes, ldf, qdf, groups, participant_files_path)
+        saved = None if full else instrument.run('loadState', loadState, state_dir)
+        if saved:
+            same = [doc for doc in todo if saved['hashes'].get(doc) == hashes[doc]]
+            todo = [doc for doc in todo if saved['hashes'].get(doc) != hashes[doc]]
+            if same:
+                results.append(restoreResult(saved['result'], ldf, same))
+
+    batches = batchDocuments(sizes[todo], jobs)
+    parts = [ldf[docs.isin(batch)].copy() for batch in batches]
+    args = (parts, [batchQuotations(part, qdf, groups) for part in parts], [participant_files_path] * len(parts))
+    if jobs > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            if instrument.enabled:
+                # bring back the stages the workers recorded
+                collected = list(pool.map(instrument.collect, [runBatch] * len(parts), *args))
+                results.extend(result for result, stages in collected)
+                for result, stages in collected:
+                    instrument.records.extend(stages)
+            else:
+                results.extend(pool.map(runBatch, *args))
+    else:
+        issues = list(validation.issues)
+        results.extend(map(runBatch, *args))
+        validation.issues[:] = issues
+    if not results:
+        # no links at all, run the stages on the empty table so it still gets their columns
+        issues = list(validation.issues)
+        results = [runBatch(ldf, qdf, participant_files_path)]
+        validation.issues[:] = issues
+
+    df = pd.concat([result[0] for result in results]).sort_index()
+    # saved results keep the categories of their run, use this run's
+    df = df.astype({col: ldf[col].dtype for col in ldf.select_dtypes('category') if col in df})
+    # in row order, so the report does not depend on which documents were processed or how they were batched
+    issues = [result[2] for result in results if not result[2].empty]
+    issues = pd.concat(issues, ignore_index=True).sort_values('Row', kind='stable', ignore_index=True) if issues else pd.DataFrame(columns=validation.REPORT_COLUMNS)
+    combinedColumns = results[-1][1]
+    if state_dir and (saved is None or saved['hashes'] != hashes):
+        instrument.run('saveState', saveState, state_dir, hashes, keyResult((df, combinedColumns, issues), ldf))
+    if not issues.empty:
+        validation.issues.append(issues)
+    return df, combinedColumns
+
+def documentKeys(ldf):
+    '''
+    (document, position within the document) of every links row. Unlike row labels, these do not
+    shift when links are added or removed in other documents.
+    param ldf: links data frame
+    return MultiIndex in the order of ldf
+    '''
+    docs = ldf['Source Doc']
+    return pd.MultiIndex.from_arrays([docs.to_numpy(), docs.groupby(docs, sort=False).cumcount().to_numpy()])
+
+def keyResult(result, ldf):
+    '''
+    Key merged results on documentKeys instead of row labels, to be saved
+    param result: (links data frame, combined column names, validation issues), rows labelled as in ldf
+    param ldf: links data frame the results were computed from
+    return result tuple with document keys for the links rows and the issue rows
+    '''
+    df, combinedColumns, issues = result
+    keys = documentKeys(ldf)
+    df = df.set_axis(keys[ldf.index.get_indexer(df.index)])
+    issues = issues.drop(columns='Row').set_axis(keys[ldf.index.get_indexer(issues['Row'])])
+    return df, combinedColumns, issues
+
+def restoreResult(result, ldf, docs):
+    '''
+    Undo keyResult for some documents of this run's links
+    param result: result tuple from keyResult
+    param ldf: links data frame of this run
+    param docs: list, documents to take from the saved results
+    return result tuple with this run's row labels
+    '''
+    df, combinedColumns, issues = result
+    keys = documentKeys(ldf)
+    df = df[df.index.get_level_values(0).isin(docs)]
+    issues = issues[issues.index.get_level_values(0).isin(docs)]
+    df = df.set_axis(ldf.index[keys.get_indexer(df.index)])
+    rows = ldf.index[keys.get_indexer(issues.index)]
+    issues = issues.reset_index(drop=True)
+    issues.insert(0, 'Row', rows)
+    return df, combinedColumns, issues
+
+def statePath(state_dir):
+    '''
+    return str, file holding the saved results and document hashes
+    '''
+    return os.path.join(state_dir, 'results.pkl')
+
+def loadState(state_dir):
+    '''
+    Load the results saved by the last run
+    param state_dir: str, where the results are kept
+    return dict with 'hashes' (document -> content hash) and 'result' (from keyResult), None if there are no usable saved results
+    '''
+    path = statePath(state_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def saveState(state_dir, hashes, result):
+    '''
+    Save the results of every document with the content hashes they were computed from
+    param state_dir: str, where the results are kept
+    param hashes: dict from documentHashes
+    param result: result tuple from keyResult
+    '''
+    os.makedirs(state_dir, exist_ok=True)
+    path = statePath(state_dir)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump({'hashes': hashes, 'result': result}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+def stateDir(links_data_path):
+    '''
+    return str, where per-document results for a links export are kept between runs
+    '''
+    where = hashlib.sha1(os.path.abspath(links_data_path).encode()).hexdigest()[:8]
+    return os.path.join(cache.CACHE_DIR, 'docs', where)
+
+def run(quotations_data_path, links_data_path, participant_files_path=None, combined_data_path=None, distance_data_path=None, jobs=1, incremental=False, full=False):
+    '''
+    Runs combineql -> distance -> percentage in memory
+    param quotations_data_path: str, quotations export path
+    param links_data_path: str, links export path
+    param participant_files_path: str, path to participant files, None to skip speaker counts
+    param combined_data_path: str, where to write the combined links, None to not write them
+    param distance_data_path: str, where to write the links with distances, None to not write them
+    param jobs: int, number of processes, documents are processed in parallel when more than 1
+    param incremental: bool, keep per-document results and only process documents that changed since the last run
+    param full: bool, with incremental, process every document and replace the kept results
+    return (links data frame with distances and speakers, dict of summary tables)
+    '''
+    qdf, ldf = combineql.loadInputs(quotations_data_path, links_data_path)
+    if jobs > 1 or incremental:
+        # per-link work of every stage, one document at a time
+        state_dir = stateDir(links_data_path) if incremental else None
+        df, combinedColumns = instrument.run('runDocuments', runDocuments, ldf, qdf, participant_files_path, jobs, state_dir, full)
+        if combined_data_path:
+            instrument.run('writeCombined', cache.write_table, df[combinedColumns], combined_data_path)
+    else:
+        # combine quotations and links
+        df = combineql.combine(ldf, qdf)
+        if combined_data_path:
+            instrument.run('writeCombined', cache.write_table, df, combined_data_path)
+
+        # add distances
+        df = instrument.run('addLineDiffs', distance.addLineDiffs, df)
+        df = instrument.run('addRefDiffs', distance.addRefDiffs, df)
+
+    # distance statistics
+    tables = {'Distance Stats': instrument.run('distanceStats', distance.distanceStats, df), 'Distance Histogram': instrument.run('distanceHistogram', distance.distanceHistogram, df)}
+    distance.printStats(tables['Distance Stats'])
+    if distance_data_path:
+        instrument.run('writeDistance', cache.write_table, df.drop(columns=percentage.SPEAKER_COLUMNS, errors='ignore'), distance_data_path)
+
+    # get counts of anaphor, cataphor, exophora, relationships for participant and madeline
+    if participant_files_path:
+        if 'Relation Speaker' not in df:
+            df = instrument.run('add_speakers', percentage.add_speakers, df, participant_files_path)
+        speakerTables = instrument.run('speaker_tables', percentage.speaker_tables, df)
+        percentage.print_tables(speakerTables)
+        tables.update(speakerTables)
+    return df, tables
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    participant_files_path = None
+    combined_data_path = None
+    distance_data_path = None
+    report_path = None
+    jobs = 1
+    full = False
+    if arguments and arguments[0] == 'query':
+        query.main(arguments[1:])
+        return
+    if not arguments or arguments.pop(0) != 'run' or len(arguments) < 6:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-q':
+            quotations_data_path = arguments.pop(0)
+        elif argument == '-l':
+            links_data_path = arguments.pop(0)
+        elif argument == '-o':
+            output_data_path = arguments.pop(0)
+        elif argument == '-d':
+            participant_files_path = arguments.pop(0)
+        elif argument == '-c':
+            combined_data_path = arguments.pop(0)
+        elif argument == '-t':
+            distance_data_path = arguments.pop(0)
+        elif argument == '-r':
+            report_path = arguments.pop(0)
+        elif argument in ('-j', '--jobs'):
+            jobs = int(arguments.pop(0))
+        elif argument == '--full':
+            full = True
+        elif instrument.option(argument, arguments):
+            pass
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data files exists
+    if not os.path.exists(quotations_data_path) or not os.path.exists(links_data_path):
+        usage(1)
+
+    df, tables = run(quotations_data_path, links_data_path, participant_files_path, combined_data_path, distance_data_path, jobs, True, full)
+
+    # export to output file, with the validation issues as one more table
+    tables['Validation'] = validation.report()
+    instrument.run('writeTables', cache.write_tables, df, tables, output_data_path)
+
+    # report validation issues
+    validation.print_summary()
+    if report_path:
+        validation.write_report(report_path)
+    instrument.finish()
+
+if __name__ == '__main__':
+    main()
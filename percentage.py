@@ -2,132 +2,166 @@
 
 import sys 
 import pandas as pd
+import numpy as np
 import os
 import re 
+import validation
+import cache
+import combineql
+import instrument
+import transcripts
 
 def usage(exitcode=0): 
     progname = os.path.basename(sys.argv[0])
-    print(f'''Usage: {progname} -i input_data.xlsx -o output_data.xlsx []
+    print(f'''Usage: {progname} -i input_data.feather -o output_data.feather -d participant_files_dir/ [-r report.csv]
     -i input_data_path      Output from combineql.py
-    -o output_data_path     Output data file
-    -d participant_files_dir path to participant files''')
+    -o output_data_path     Output data file (.feather, .parquet, .csv or .xlsx), tables go on extra sheets or next to it
+    -d participant_files_dir path to participant files
+    -r report_path          Validation report file (.csv, .parquet or .xlsx)
+{instrument.USAGE}''')
     sys.exit(exitcode)
 
-def error(message, df, index): 
+SPEAKERS = {0: "Participant", 1: "Madeline"} 
+SPEAKER_COLUMNS = ['Source Speaker', 'Target Speaker', 'Relation Speaker'] 
+RELATIONS = ["Anaphor", "Cataphor", "Exophora"] 
+CODES = ["Anaphor", "Antecedent", "Cataphor", "Postcedent", "Exophora"] 
+
+def get_counts(df, participant_files_path, index_dir=transcripts.INDEX_DIR): 
     '''
-    Prints a message and a specified row of the data frame
-    param message: error message 
-    param df: data frame 
-    param index: row # in data frame with error 
+    Attach speakers to the links, then tally relations and codes by speaker 
+    param df: combined links data frame 
+    param participant_files_path: str, path to participant files 
+    param index_dir: str, where transcript indexes are kept 
+    return (data frame with speaker columns, dict of speaker tables) 
     '''
-    print(f"ERROR: {message}")
-    print(df.loc[[index]])
+    df = instrument.run('add_speakers', add_speakers, df, participant_files_path, index_dir) 
+    tables = instrument.run('speaker_tables', speaker_tables, df) 
+    print_tables(tables) 
+    return df, tables 
 
-def get_counts(df, participant_files_path): 
-    m_counts = {"Anaphor": 0, "Cataphor": 0, "Exophora": 0} 
-    p_counts = {"Anaphor": 0, "Cataphor": 0, "Exophora": 0} 
+def add_speakers(df, participant_files_path, index_dir=transcripts.INDEX_DIR): 
+    '''
+    Adds Source Speaker and Target Speaker columns (Madeline or Participant), and Relation Speaker: 
+    the source speaker for Exophora and Cataphor, the target speaker for Anaphor 
+    param df: combined links data frame 
+    param participant_files_path: str, path to participant files 
+    param index_dir: str, where transcript indexes are kept 
+    return data frame 
+    '''
+    df = combineql.addIDColumns(df)
+    # speakers of every line, built once per participant file 
+    speaker_index = {} 
+    s_doc = (df['Source Doc'] + 1) // 2 # TODO: may want to check if these are in correct range (1,11) 
+    t_doc = (df['Target Doc'] + 1) // 2 
+    df['Source Speaker'] = line_speakers(s_doc, df['Source Line'], participant_files_path, speaker_index, index_dir) 
+    df['Target Speaker'] = line_speakers(t_doc, df['Target Line'], participant_files_path, speaker_index, index_dir) 
+    unknown = df['Source Speaker'].isna() | df['Target Speaker'].isna() 
+    validation.record('unknown-speaker', "neither participant or madeline found", df, unknown, ['SID', 'Source Line', 'TID', 'Target Line'])
+
+    relation = df['Relation'] 
+    df['Relation Speaker'] = df['Source Speaker'].where(relation.isin(['Exophora', 'Cataphor']), df['Target Speaker'].where(relation == 'Anaphor')) 
+    validation.record('unknown-relation', "relation not accepted", df, ~relation.isin(RELATIONS), ['SID', 'TID', 'Relation'])
+    return df 
 
-    m_codes = {"Anaphor": 0, "Antecedent": 0, "Cataphor": 0, "Postcedent": 0, "Exophora": 0} 
-    p_codes = {"Anaphor": 0, "Antecedent": 0, "Cataphor": 0, "Postcedent": 0, "Exophora": 0} 
-    
-    for index in df.index: 
-        sid = df['SID'][index]
-        tid = df['TID'][index]
-        s_doc = int((int(sid.split(':')[0]) + 1)/2) # TODO: may want to check if these are in correct range (1,11) 
-        t_doc = int((int(tid.split(':')[0]) + 1)/2)
-        s_line = df['Source Line'][index] 
-        t_line = df['Target Line'][index] 
-        sourceCode = df['Source Code'][index]  
-        targetCode = df['Target Code'][index] 
-        relation = df['Relation'][index]
-        t_speaker = get_speaker(t_doc, t_line, participant_files_path) # 0 = P, 1 = M 
-        s_speaker = get_speaker(s_doc, s_line, participant_files_path) # 0 = P, 1 = M 
-        if targetCode != "Referent":
-            m_codes,p_codes = add_counts(t_speaker, targetCode, m_codes, p_codes) 
-        m_codes,p_codes = add_counts(s_speaker, sourceCode, m_codes, p_codes) 
-        if relation == 'Exophora' or relation == 'Cataphor': 
-            speaker = s_speaker
-        elif relation == 'Anaphor':  
-            speaker = t_speaker
-        else: 
-            print(f"ERROR: {relation} not accepted!") 
-        m_counts,p_counts = add_counts(speaker, relation, m_counts, p_counts) 
-        #print(m_counts, p_counts) 
-        #print(f"sid: {sid}, s_doc: {s_doc}, tid: {tid}, t_doc: {t_doc}")
-    get_relation_stats("Madeline", m_counts) 
-    get_relation_stats("Participant", p_counts) 
-    both = {"Anaphor": m_counts["Anaphor"] + p_counts["Anaphor"], "Cataphor": m_counts["Cataphor"] + p_counts["Cataphor"], "Exophora": m_counts["Exophora"] + p_counts["Exophora"]}
-    get_relation_stats("Both", both)
+def tally(speakers, keys, columns, documents=None): 
+    '''
+    Contingency table of speaker by key with each speaker's total and percentages 
+    param speakers: series, speaker of each row 
+    param keys: series, relation or code of each row 
+    param columns: list, keys to always show, in order 
+    param documents: series, document of each row to break the table down by, None for no breakdown 
+    return data frame 
+    '''
+    rows = [speakers.rename('Speaker')] if documents is None else [documents.rename('Document'), speakers.rename('Speaker')] 
+    counts = pd.crosstab(rows, keys) 
+    counts = counts.reindex(columns=columns + [c for c in counts.columns if c not in columns], fill_value=0) 
+    if documents is None: 
+        counts.loc['Both'] = counts.sum() 
+    counts.columns.name = None 
+    total = counts.sum(axis=1) 
+    percents = counts.div(total.where(total > 0), axis=0) * 100 
+    percents.columns = [f"{c} %" for c in percents.columns] 
+    return pd.concat([counts, total.rename('Total'), percents], axis=1).reset_index() 
+
+def speaker_tables(df): 
+    '''
+    Relation and code tallies by speaker, overall and per document (Source Doc), from one pass over the links 
+    param df: data frame with speaker columns from add_speakers 
+    return dict of table name -> data frame 
+    '''
+    # every source code counts for its speaker, target codes count unless they are Referent 
+    target = df['Target Code'] != 'Referent' 
+    code_speakers = pd.concat([df['Source Speaker'], df.loc[target, 'Target Speaker']], ignore_index=True) 
+    codes = pd.concat([df['Source Code'], df.loc[target, 'Target Code']], ignore_index=True) 
+    code_docs = pd.concat([df['Source Doc'], df.loc[target, 'Source Doc']], ignore_index=True) 
+    return { 
+        'Relations': tally(df['Relation Speaker'], df['Relation'], RELATIONS), 
+        'Codes': tally(code_speakers, codes, CODES), 
+        'Relations by Document': tally(df['Relation Speaker'], df['Relation'], RELATIONS, df['Source Doc']), 
+        'Codes by Document': tally(code_speakers, codes, CODES, code_docs), 
+    } 
+
+def print_tables(tables): 
+    '''
+    Prints the overall relation and code tallies 
+    param tables: dict from speaker_tables 
+    '''
+    print("Relations") 
+    print(tables['Relations'].to_string(index=False, float_format=lambda p: f"{p:.4}")) 
     print("Codes") 
-    get_code_stats("Madeline", m_codes) 
-    get_code_stats("Participant", p_codes)
-    return df 
+    print(tables['Codes'].to_string(index=False, float_format=lambda p: f"{p:.4}")) 
 
+def participant_filename(doc): 
+    '''
+    Build the transcript file name for a participant number 
+    param doc: int, participant number (ex: 3) 
+    return str, file name (ex: 'participant03.txt') 
+    '''
+    return f"participant{doc:02d}.txt" 
 
-def get_code_stats(speaker, counts): 
-    total = 0 
-    for key in counts: 
-        total += counts[key]  
-    a_per = counts['Anaphor']/total * 100 
-    c_per = counts['Cataphor']/total * 100 
-    e_per = counts['Exophora']/total * 100 
-    p_per = counts['Postcedent']/total * 100 
-    an_per = counts['Antecedent']/total * 100 
-    print(f"{speaker} Total: {total}, Anaphor Percentage: {a_per:.4}%, Antecedent Percentage: {an_per:.4}, Cataphor Percentage: {c_per:.4}%, Postcedent Percentage: {p_per:.4}, Exophora Percentage: {e_per:.4}%") 
-
-
-
-
-
-
-def get_relation_stats(speaker, counts): 
-    total = 0 
-    for key in counts: 
-        total += counts[key] # TODO maybe figure out why they aren't exactly the same as generated by atlas  
-    a_per = counts['Anaphor']/total * 100 
-    c_per = counts['Cataphor']/total * 100 
-    e_per = counts['Exophora']/total * 100 
-    print(f"{speaker} Total: {total}, Anaphor Percentage: {a_per:.4}%, Cataphor Percentage: {c_per:.4}%, Exophora Percentage: {e_per:.4}%") 
-
-def add_counts(speaker, key, m, p):
-    if speaker: # M 
-        m[key] += 1 
-    else: # P 
-        p[key] += 1 
-    return m,p
-        
-def get_speaker(doc, line, ppath): 
-    #print(f"In get_speaker. doc: {doc}, line: {line}") 
-    orig_doc = doc 
-    if doc < 10: 
-        doc = '0' + str(doc) 
-    filename = "participant" + str(doc) + ".txt" 
-    #print(f"filename: {filename}") 
-    path = ppath + filename 
-    #print(f"path: {path}")
-    participant_file = open(path, "r") 
-    lines = participant_file.readlines() 
-    myline = lines[line - 1] # account for zero indexing in a list 
-    p_mark0 = f"] participant{doc}:"
-    p_mark1 = f"] particpant{doc}:"
-    m_mark = f"] Madeline - Virtual Assistant:" 
-    #print(f"pmark: {p_mark}, mmark: {m_mark}") 
-    if p_mark0 in myline or p_mark1 in myline:
-        #print(f"participant found in {myline}") 
-        #print("P") 
-        return 0
-    elif m_mark in myline: 
-        #print(f"madeline found in {myline}") 
-        #print("M") 
-        return 1 
-    else: 
-        print(f"doc: {doc}, line: {line} neither participant or madeline found in {myline}!") 
-        print(f"Trying line {line - 1}") 
-        return get_speaker(orig_doc, line - 1, ppath) # try the previous line 
+def build_speaker_index(doc, ppath, index_dir=transcripts.INDEX_DIR): 
+    '''
+    Resolves the speaker of every line of a participant file from its transcript index, 
+    which is built on first use and reused until the file changes. 
+    Lines without a speaker marker (continuation lines) inherit the last speaker seen. 
+    param doc: int, participant number 
+    param ppath: str, path to participant files 
+    param index_dir: str, where transcript indexes are kept 
+    return array, speakers[line] = 0 (P), 1 (M) or NaN (no speaker yet); index 0 unused 
+    '''
+    transcript = transcripts.Transcript(ppath + participant_filename(doc), doc, index_dir) 
+    transcript.close() 
+    return np.where(transcript.speakers == transcripts.NO_SPEAKER, np.nan, transcript.speakers) 
+
+def line_speakers(docs, lines, ppath, speaker_index=None, index_dir=transcripts.INDEX_DIR): 
+    '''
+    Look up the speaker of many lines in the participant files 
+    param docs: series, participant number of each line 
+    param lines: series, line number (1 indexed) of each line 
+    param ppath: str, path to participant files 
+    param speaker_index: dict, doc -> speakers array, filled in on first use of each doc 
+    param index_dir: str, where transcript indexes are kept 
+    return series of "Madeline", "Participant" or NaN if no speaker found 
+    '''
+    if speaker_index is None: 
+        speaker_index = {} 
+    doc_values = docs.to_numpy() 
+    line_values = pd.to_numeric(lines, errors='coerce').fillna(0).to_numpy(int) 
+    found = np.full(len(docs), np.nan) 
+    for doc in np.unique(doc_values): 
+        if doc not in speaker_index: 
+            speaker_index[doc] = instrument.run('build_speaker_index', build_speaker_index, doc, ppath, index_dir) 
+        speakers = speaker_index[doc] 
+        rows = np.flatnonzero(doc_values == doc) 
+        line = line_values[rows] 
+        ok = (line >= 1) & (line < len(speakers)) 
+        found[rows[ok]] = speakers[line[ok]] 
+    return pd.Series(found, index=docs.index).map(SPEAKERS) 
 
 def main(): 
     # command line parsing 
     arguments = sys.argv[1:]
+    report_path = None
     if len(arguments) < 4: 
         usage(0)
     while arguments and arguments[0].startswith('-'):
@@ -138,6 +172,10 @@ def main():
             output_data_path = arguments.pop(0)
         elif argument == '-d': 
             participant_files_path = arguments.pop(0) 
+        elif argument == '-r':
+            report_path = arguments.pop(0)
+        elif instrument.option(argument, arguments):
+            pass
         elif argument == '-h':
             usage(0)
         else:
@@ -148,15 +186,21 @@ def main():
         usage(1)
 
     # create data frames 
-    df = pd.DataFrame() 
-    df = df.append(pd.read_excel(input_data_path), ignore_index=True)
+    df = instrument.run('read_table', cache.read_table, input_data_path)
     
     # get counts of anaphor, cataphor, exophora, relationships for participant and madeline 
-    df = get_counts(df, participant_files_path) 
+    df, tables = get_counts(df, participant_files_path) 
  
-    # export to output file
+    # export to output file, with the tallies and validation issues as extra sheets 
     # print(df)
-    df.to_excel(f"{output_data_path}")
+    tables['Validation'] = validation.report() 
+    instrument.run('write_tables', cache.write_tables, df, tables, output_data_path)
+
+    # report validation issues 
+    validation.print_summary()
+    if report_path: 
+        validation.write_report(report_path)
+    instrument.finish()
 
 if __name__ == '__main__': 
     main() 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+'''
+Indexed queries over the links with distances and speakers (lingpipe.py or percentage.py output),
+ex: all cataphors in document 6 spoken by Madeline with a line distance over 3.
+The links and their indexes (row positions for every value of the key columns, rows sorted by
+each distance) are built once per input file and saved under the cache directory, so later
+queries only load them and intersect row positions instead of re-reading and scanning the links.
+'''
+
+import sys
+import os
+import numpy as np
+import pandas as pd
+import cache
+
+# columns queried by value, option name -> column
+KEY_COLUMNS = {
+    'doc': 'Source Doc',
+    'target_doc': 'Target Doc',
+    'relation': 'Relation',
+    'source_code': 'Source Code',
+    'target_code': 'Target Code',
+    'speaker': 'Relation Speaker',
+    'source_speaker': 'Source Speaker',
+    'target_speaker': 'Target Speaker',
+}
+# columns queried by range, option name -> column
+RANGE_COLUMNS = {
+    'line_diff': 'Line Diff',
+    'ref_diff': 'Ref Diff',
+}
+INDEX_DIR = os.path.join(cache.CACHE_DIR, 'query')
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -i links_data.feather [--doc 6 --relation Cataphor --min-line-diff 3 ... -o result.csv --count]
+    -i input_data_path       Output from lingpipe.py (or percentage.py)
+    -o output_data_path      Write the matching links here instead of printing them
+    --count                  Only print how many links match
+    --doc, --target-doc n    Source or target document #
+    --relation relation      Anaphor, Cataphor or Exophora
+    --source-code code       Source code (ex: Antecedent)
+    --target-code code       Target code (ex: Postcedent)
+    --speaker speaker        Relation speaker: Madeline or Participant
+    --source-speaker speaker, --target-speaker speaker
+    --min-line-diff n, --max-line-diff n
+    --min-ref-diff n, --max-ref-diff n   Distance ranges (inclusive)
+    Repeating a value option matches any of its values''')
+    sys.exit(exitcode)
+
+def buildIndex(df):
+    '''
+    Index the links for queries
+    param df: links data frame with distance and speaker columns
+    return dict of arrays: for a key column, '<column>:values' and for each value the rows holding it
+    ('<column>:order' split at '<column>:starts'); for a range column, '<column>:order' sorting the rows
+    by it and '<column>:sorted' the sorted values, rows without a value left out
+    '''
+    index = {}
+    for column in KEY_COLUMNS.values():
+        if column not in df:
+            continue
+        codes, values = pd.factorize(df[column].astype(str))
+        order = np.argsort(codes, kind='stable')
+        index[f"{column}:values"] = np.asarray(values, dtype=str)
+        index[f"{column}:order"] = order
+        index[f"{column}:starts"] = np.searchsorted(codes[order], np.arange(len(values) + 1))
+    for column in RANGE_COLUMNS.values():
+        if column not in df:
+            continue
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(float)
+        order = np.argsort(values, kind='stable')
+        order = order[~np.isnan(values[order])]
+        index[f"{column}:order"] = order
+        index[f"{column}:sorted"] = values[order]
+    return index
+
+class LinkIndex:
+    '''
+    Links with their query indexes
+    '''
+
+    def __init__(self, df, index):
+        self.df = df
+        self.index = index
+
+    @classmethod
+    def load(cls, path, index_dir=INDEX_DIR):
+        '''
+        Load the links and indexes of a file, building and saving them the first time and when the file changes
+        param path: str, links file (.feather, .parquet, .csv or Excel)
+        param index_dir: str, where indexes are kept, None to always build them
+        return LinkIndex
+        '''
+        if index_dir is None or not cache.has_pyarrow():
+            df = readLinks(path)
+            return cls(df, buildIndex(df))
+        links_path = cache.cache_path(path, index_dir)
+        index_path = links_path[:-len('.feather')] + '.npz'
+        if os.path.exists(links_path) and os.path.exists(index_path):
+            with np.load(index_path) as npz:
+                df = cache.read_feather(links_path).set_index('index').rename_axis(None)
+                return cls(df, {key: npz[key] for key in npz.files})
+        df = readLinks(path)
+        index = buildIndex(df)
+        # the links first so a saved index always has its links next to it
+        cache.store(df.reset_index(), links_path)
+        with open(index_path + '.tmp', 'wb') as f:
+            np.savez(f, **index)
+        os.replace(index_path + '.tmp', index_path)
+        cache.prune(path, index_dir)
+        return cls(df, index)
+
+    def rows(self, column, values):
+        '''
+        return sorted array of the rows where column holds one of the values
+        '''
+        known = self.index[f"{column}:values"]
+        order, starts = self.index[f"{column}:order"], self.index[f"{column}:starts"]
+        found = [order[starts[i]:starts[i + 1]] for i in np.flatnonzero(np.isin(known, [str(v) for v in values]))]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def range(self, column, low=None, high=None):
+        '''
+        return sorted array of the rows where column is between low and high (inclusive, None for no limit)
+        '''
+        ordered = self.index[f"{column}:sorted"]
+        first = 0 if low is None else np.searchsorted(ordered, low, side='left')
+        last = len(ordered) if high is None else np.searchsorted(ordered, high, side='right')
+        return np.sort(self.index[f"{column}:order"][first:last])
+
+    def positions(self, **criteria):
+        '''
+        Row positions matching every criterion
+        param criteria: KEY_COLUMNS option -> value or list of values, and min_/max_ RANGE_COLUMNS option -> limit
+        (ex: relation='Cataphor', doc=6, min_line_diff=3)
+        return sorted array of row positions
+        '''
+        found = []
+        for option, column in KEY_COLUMNS.items():
+            if criteria.get(option) is not None:
+                values = criteria.pop(option)
+                if column not in self.df:
+                    raise KeyError(f"{column} is not in the links")
+                found.append(self.rows(column, values if isinstance(values, (list, tuple)) else [values]))
+        for option, column in RANGE_COLUMNS.items():
+            low, high = criteria.pop(f"min_{option}", None), criteria.pop(f"max_{option}", None)
+            if low is not None or high is not None:
+                if column not in self.df:
+                    raise KeyError(f"{column} is not in the links")
+                found.append(self.range(column, low, high))
+        if criteria:
+            raise TypeError(f"unknown query options: {', '.join(criteria)}")
+        if not found:
+            return np.arange(len(self.df))
+        # intersect the smallest sets first
+        found.sort(key=len)
+        rows = found[0]
+        for more in found[1:]:
+            rows = np.intersect1d(rows, more, assume_unique=True)
+        return rows
+
+    def query(self, **criteria):
+        '''
+        param criteria: as for positions
+        return data frame of the matching links, in their original order
+        '''
+        return self.df.iloc[self.positions(**criteria)]
+
+def readLinks(path):
+    '''
+    Read a links file, using the first column as the index when it is an unnamed one written by Excel exports
+    param path: str, links file path
+    return data frame
+    '''
+    df = cache.read_table(path)
+    if len(df.columns) and df.columns[0] == 'Unnamed: 0':
+        df = df.set_index('Unnamed: 0').rename_axis(None)
+    return df
+
+def query(path, **criteria):
+    '''
+    Query a links file through its saved index
+    param path: str, links file path
+    param criteria: as for LinkIndex.positions
+    return data frame of the matching links
+    '''
+    return LinkIndex.load(path).query(**criteria)
+
+def main(arguments=None):
+    # command line parsing
+    arguments = sys.argv[1:] if arguments is None else list(arguments)
+    output_data_path = None
+    count = False
+    criteria = {}
+    if len(arguments) < 2:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        option = argument.lstrip('-').replace('-', '_')
+        if argument == '-i':
+            input_data_path = arguments.pop(0)
+        elif argument == '-o':
+            output_data_path = arguments.pop(0)
+        elif argument == '--count':
+            count = True
+        elif option in ('doc', 'target_doc'):
+            criteria.setdefault(option, []).append(int(arguments.pop(0)))
+        elif option in KEY_COLUMNS:
+            criteria.setdefault(option, []).append(arguments.pop(0))
+        elif option.startswith(('min_', 'max_')) and option[4:] in RANGE_COLUMNS:
+            criteria[option] = float(arguments.pop(0))
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data files exists
+    if not os.path.exists(input_data_path):
+        usage(1)
+
+    df = query(input_data_path, **criteria)
+    if count:
+        print(len(df))
+    elif output_data_path:
+        cache.write_table(df, output_data_path)
+    else:
+        print(df.to_string())
+
+if __name__ == '__main__':
+    main()
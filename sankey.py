@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+'''
+Sankey diagrams of how codes flow into participant documents, as in the ATLAS.ti Code-Document table.
+The combined links are aggregated once into a flow table (quotations and words for every
+document and code, each quotation counted once however many links it is in), which is cached
+next to the parsed tables. Every variant (all codes or without references, quotations or words
+weighted, raw or normalized) is drawn from that table without going back to the links.
+Quotations that are in no link are not in the links export, so their counts can be a little
+below the Code-Document table's.
+Drawing needs plotly (and kaleido for .pdf/.png/.svg); without it only the flow matrices are written.
+'''
+
+import sys
+import os
+import pandas as pd
+import cache
+import combineql
+import stream
+
+FLOW_COLUMNS = ['Document', 'Code', 'Quotations', 'Words']
+FLOW_CACHE = 'codeflows'
+# name part -> (include Referent and the exophora documents, weight column, normalize per document)
+VARIANTS = {
+    'allcodes': (True, 'Quotations', False),
+    'allcodes_normalized': (True, 'Quotations', True),
+    'allcodes_words': (True, 'Words', False),
+    'allcodes_words_normalized': (True, 'Words', True),
+    'noref': (False, 'Quotations', False),
+    'noref_normalized': (False, 'Quotations', True),
+    'noref_words': (False, 'Words', False),
+    'noref_words_normalized': (False, 'Words', True),
+}
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -i combined_data.feather -o output_dir/ [-f pdf -m flows.xlsx --no-cache]
+    -i input_data_path      Output from combineql.py
+    -o output_dir           Where to write sankey_diagram_<variant>.<format> for every variant
+    -f format               Diagram format: pdf, png, svg or html (default pdf)
+    -m matrix_path          Also write the document by code matrix of every variant (.xlsx gets one sheet each)
+    --no-cache              Aggregate the links again even if their flow table is cached''')
+    sys.exit(exitcode)
+
+def has_plotly():
+    '''
+    return True if plotly is installed (needed to draw the diagrams)
+    '''
+    try:
+        import plotly
+    except ImportError:
+        return False
+    return True
+
+def documentNames(docs):
+    '''
+    param docs: series of document numbers (odd for participant files, even for their exophoras files)
+    return series of document names, participantNN or participantNN_exophoras
+    '''
+    names = 'participant' + ((docs + 1) // 2).astype(str).str.zfill(2)
+    return names.where(docs % 2 == 1, names + '_exophoras')
+
+def flowTable(df):
+    '''
+    Aggregate the quotations of the links into flows, in one pass over the links
+    param df: combined links data frame
+    return data frame with the number of quotations and the number of words in them
+    for every document (participant file name) and code
+    '''
+    df = combineql.addIDColumns(df)
+    sides = [df[[f'{side} Doc', f'{side} Ref', f'{side} Code', side]].set_axis(['Doc', 'Ref', 'Code', 'Text'], axis=1) for side in ('Source', 'Target')]
+    # a quotation is in as many links as it has relations, count it once
+    quotations = pd.concat(sides, ignore_index=True).drop_duplicates(['Doc', 'Ref', 'Code'])
+    flows = pd.DataFrame({
+        'Document': documentNames(quotations['Doc']),
+        'Code': quotations['Code'],
+        'Quotations': 1,
+        'Words': quotations['Text'].fillna('').astype(str).str.split().str.len(),
+    })
+    return flows.groupby(FLOW_COLUMNS[:2], as_index=False, sort=True)[['Quotations', 'Words']].sum()
+
+def loadFlows(path, use_cache=True):
+    '''
+    Flow table of a combined links file, aggregated once and then served from the cache until the file changes
+    param path: str, combined links file path
+    param use_cache: bool, False to aggregate again and replace the cached table
+    return data frame from flowTable
+    '''
+    cache_dir = os.path.join(cache.CACHE_DIR, FLOW_CACHE)
+    cached = cache.cache_path(path, cache_dir)
+    if use_cache and os.path.exists(cached):
+        return cache.read_feather(cached)
+    flows = flowTable(cache.read_table(path))
+    if cache.has_pyarrow():
+        cache.store(flows, cached)
+        cache.prune(path, cache_dir)
+    return flows
+
+def variantFlows(flows, references=True, weight='Quotations', normalized=False):
+    '''
+    Select and weight the flows of one variant
+    param flows: data frame from flowTable
+    param references: bool, False to leave out the Referent code and the exophora documents it is applied in
+    param weight: str, 'Quotations' or 'Words'
+    param normalized: bool, scale each document's flows to add up to 1 so every document counts the same
+    return data frame with Document, Code and Weight columns
+    '''
+    if not references:
+        flows = flows[(flows['Code'] != 'Referent') & ~flows['Document'].str.endswith('_exophoras')]
+    flows = flows[FLOW_COLUMNS[:2]].assign(Weight=flows[weight].astype(float))
+    if normalized:
+        flows['Weight'] = flows['Weight'] / flows.groupby('Document')['Weight'].transform('sum')
+    return flows
+
+def flowMatrix(flows):
+    '''
+    param flows: data frame from variantFlows
+    return data frame, documents by codes (the Absolute columns of the Code-Document table)
+    '''
+    return flows.pivot_table(index='Document', columns='Code', values='Weight', aggfunc='sum', fill_value=0)
+
+def sankeyFigure(flows, title):
+    '''
+    Draw code -> document flows
+    param flows: data frame from variantFlows
+    param title: str, diagram title
+    return plotly figure
+    '''
+    import plotly.graph_objects as go
+    codes = pd.Index(sorted(flows['Code'].unique()))
+    docs = pd.Index(sorted(flows['Document'].unique()))
+    fig = go.Figure(go.Sankey(
+        node={'label': list(codes) + list(docs), 'pad': 12},
+        link={'source': codes.get_indexer(flows['Code']), 'target': len(codes) + docs.get_indexer(flows['Document']), 'value': flows['Weight']},
+    ))
+    fig.update_layout(title_text=title, font_size=11)
+    return fig
+
+def writeFigure(fig, path):
+    '''
+    Write a diagram, format chosen by extension (.html, or .pdf/.png/.svg through kaleido)
+    param fig: plotly figure
+    param path: str, output file path
+    '''
+    if os.path.splitext(path)[1].lower() == '.html':
+        fig.write_html(path)
+    else:
+        fig.write_image(path)
+
+def renderAll(flows, output_dir, fmt='pdf', matrix_path=None):
+    '''
+    Draw every variant from one flow table
+    param flows: data frame from flowTable
+    param output_dir: str, directory for the diagrams
+    param fmt: str, diagram format
+    param matrix_path: str, where to write the flow matrices, None to not write them
+    return dict of variant name -> flow matrix
+    '''
+    draw = has_plotly()
+    if not draw:
+        print("WARNING: plotly is not installed, only the flow matrices are computed")
+    os.makedirs(output_dir, exist_ok=True)
+    matrices = {}
+    for name, (references, weight, normalized) in VARIANTS.items():
+        variant = variantFlows(flows, references, weight, normalized)
+        matrices[name] = flowMatrix(variant)
+        if draw:
+            writeFigure(sankeyFigure(variant, name.replace('_', ' ')), os.path.join(output_dir, f"sankey_diagram_{name}.{fmt}"))
+    if matrix_path:
+        writeMatrices(matrices, matrix_path)
+    return matrices
+
+def writeMatrices(matrices, path):
+    '''
+    Write flow matrices, one sheet each for Excel, <name>_<variant><ext> files otherwise
+    param matrices: dict of variant name -> flow matrix
+    param path: str, output file path
+    '''
+    writer = stream.TableWriter(path)
+    for name, matrix in matrices.items():
+        writer.write(name, matrix.rename_axis(columns=None).reset_index())
+    writer.close()
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    fmt = 'pdf'
+    matrix_path = None
+    use_cache = True
+    if len(arguments) < 4:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-i':
+            input_data_path = arguments.pop(0)
+        elif argument == '-o':
+            output_dir = arguments.pop(0)
+        elif argument == '-f':
+            fmt = arguments.pop(0)
+        elif argument == '-m':
+            matrix_path = arguments.pop(0)
+        elif argument == '--no-cache':
+            use_cache = False
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data files exists
+    if not os.path.exists(input_data_path):
+        usage(1)
+
+    # one aggregation, every variant drawn from it
+    flows = loadFlows(input_data_path, use_cache)
+    matrices = renderAll(flows, output_dir, fmt, matrix_path)
+    for name, matrix in matrices.items():
+        print(name)
+        print(matrix.to_string(float_format=lambda v: f"{v:.4}"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+'''
+Column types of the ATLAS.ti exports, checked and applied as each export is loaded.
+Low-cardinality text (documents, relations, codes, styles) is loaded as categoricals and
+counts as small integers, instead of one Python object per cell. Exports that still have
+to be parsed from Excel are parsed at the same time in worker processes.
+'''
+
+import sys
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import cache
+import atlproj
+import validation
+
+# export -> column -> dtype, every column listed must be in the export
+# 'object' columns are free text and kept as they are read
+# 'line' columns are line ranges ('62 - 64') and keep the first line number
+SCHEMAS = {
+    'quotations': {
+        'ID': 'object',
+        'Quotation Name': 'object',
+        'Document': 'category',
+        'Document Groups': 'object',
+        'Quotation Content': 'object',
+        'Comment': 'object',
+        'Codes': 'object',
+        'Reference': 'line',
+        'Density': 'int32',
+    },
+    'links': {
+        'ID': 'object',
+        'Source': 'object',
+        'Unnamed: 2': 'category',
+        'Relation': 'category',
+        'ID.1': 'object',
+        'Target': 'object',
+    },
+    'documents': {
+        'ID': 'int32',
+        'Document': 'object',
+        'Media Type': 'category',
+        'Comment': 'object',
+        'Location': 'category',
+        'Document Groups': 'object',
+        'Codes': 'object',
+        'Quotation Count': 'int32',
+    },
+    'codes': {
+        'Unnamed: 0': 'category',
+        'Code': 'category',
+        'Comment': 'object',
+        'Grounded': 'int32',
+        'Density': 'int32',
+        'Code Groups': 'object',
+    },
+    'relations': {
+        'Unnamed: 0': 'category',
+        'Relation Type': 'category',
+        'Usage': 'int32',
+        'Comment': 'object',
+        'Width': 'int32',
+        'Line Style': 'category',
+        'Layout Direction': 'category',
+        'Formal Property': 'category',
+        'Short Name': 'object',
+        'Symbolic Name': 'object',
+    },
+}
+# export -> file name the export is saved under by ATLAS.ti (ex: 'Quotation Manager (8).xlsx')
+EXPORT_NAMES = {
+    'quotations': 'Quotation Manager',
+    'links': 'Hyperlink Manager',
+    'documents': 'Document Manager',
+    'codes': 'Code Manager',
+    'relations': 'Hyperlink Relation Manager',
+}
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -d data/ [-j jobs -r report.csv]
+    -d data_dir             Directory of ATLAS.ti exports (Quotation, Hyperlink, Document, Code and Hyperlink Relation Manager)
+    -j jobs                 Most exports to parse at the same time (default one process per export, up to the number of CPUs)
+    -r report_path          Validation report file (.csv, .parquet or .xlsx)''')
+    sys.exit(exitcode)
+
+def find_exports(data_dir):
+    '''
+    Find the newest export of each kind in a directory
+    param data_dir: str, directory of exports
+    return dict of export -> path, exports that are not there are left out
+    '''
+    found = {}
+    for export, name in EXPORT_NAMES.items():
+        # 'Hyperlink Manager (7).xlsx' but not 'Hyperlink Relation Manager (3).xlsx'
+        paths = glob.glob(os.path.join(glob.escape(data_dir), f"{name}.*")) + glob.glob(os.path.join(glob.escape(data_dir), f"{name} (*).*"))
+        if paths:
+            found[export] = max(paths, key=os.path.getmtime)
+    return found
+
+def apply_schema(df, export, name=None):
+    '''
+    Check an export against its schema and convert its columns to the schema's types.
+    Values that do not fit their column are recorded as validation issues and left empty.
+    param df: data frame as read
+    param export: str, key of SCHEMAS
+    param name: str, what to call the export in errors (ex: its path)
+    return typed data frame
+    '''
+    schema = SCHEMAS[export]
+    missing = [column for column in schema if column not in df]
+    if missing:
+        raise ValueError(f"{name or export} is not a {EXPORT_NAMES[export]} export, missing columns: {', '.join(missing)}")
+    df = df.copy()
+    for column, dtype in schema.items():
+        values = df[column]
+        if dtype.startswith('int'):
+            numbers = pd.to_numeric(values, errors='coerce')
+            bad = numbers.isna() & values.notna() | numbers.notna() & (numbers % 1 != 0)
+            validation.record('bad-type', f"{column} is not a whole number", df, bad, [column])
+            numbers = numbers.mask(bad)
+            # nullable integers only where something is missing
+            df[column] = numbers.astype(dtype if numbers.notna().all() else dtype.capitalize())
+        elif dtype == 'line':
+            numbers = pd.to_numeric(values.astype(str).str.split().str[0], errors='coerce')
+            bad = numbers.isna() & values.notna() | numbers.notna() & (numbers % 1 != 0)
+            validation.record('bad-type', f"{column} is not a line number or range", df, bad, [column])
+            numbers = numbers.mask(bad)
+            # missing lines are left NaN, like the lines of links to quotations that are not there
+            df[column] = numbers.astype('int32') if numbers.notna().all() else numbers
+        elif dtype == 'category':
+            df[column] = values.astype('category')
+    return df
+
+def read_export(path, export):
+    '''
+    Read an export (or build it from a project archive) without typing it
+    param path: str, export or .atlproj path
+    param export: str, key of SCHEMAS
+    return data frame
+    '''
+    if atlproj.is_project(path):
+        return atlproj.read_table(path, export)
+    return cache.read_table(path)
+
+def load(path, export):
+    '''
+    Read an export and apply its schema
+    param path: str, export or .atlproj path
+    param export: str, key of SCHEMAS
+    return typed data frame
+    '''
+    return apply_schema(read_export(path, export), export, path)
+
+def load_collect(path, export):
+    '''
+    Load an export in a worker process
+    return (typed data frame, validation issues recorded while loading)
+    '''
+    validation.clear()
+    return load(path, export), list(validation.issues)
+
+def needs_parsing(path):
+    '''
+    return True if reading the file means parsing a workbook that is not cached yet
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if atlproj.is_project(path) or ext in ('.feather', '.parquet', '.csv'):
+        return False
+    return not cache.has_pyarrow() or not os.path.exists(cache.cache_path(path))
+
+def load_all(paths, jobs=None):
+    '''
+    Load several exports. Workbooks that are not cached yet are parsed at the same time in
+    worker processes; cached tables, columnar files and project archives are read in this process.
+    param paths: dict of export (key of SCHEMAS) -> path
+    param jobs: int, most worker processes, None for one per workbook to parse (up to the number of CPUs)
+    return dict of export -> typed data frame, in the order of paths
+    '''
+    parse = [export for export, path in paths.items() if needs_parsing(path)]
+    jobs = min(len(parse), os.cpu_count() or 1) if jobs is None else jobs
+    loaded = {}
+    if jobs > 1 and len(parse) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for export, (df, issues) in zip(parse, pool.map(load_collect, [paths[export] for export in parse], parse)):
+                loaded[export] = df
+                validation.issues.extend(issues)
+    for export, path in paths.items():
+        if export not in loaded:
+            loaded[export] = load(path, export)
+    return {export: loaded[export] for export in paths}
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    jobs = None
+    report_path = None
+    if len(arguments) < 2:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-d':
+            data_dir = arguments.pop(0)
+        elif argument == '-j':
+            jobs = int(arguments.pop(0))
+        elif argument == '-r':
+            report_path = arguments.pop(0)
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data directory exists
+    if not os.path.isdir(data_dir):
+        usage(1)
+
+    paths = find_exports(data_dir)
+    frames = load_all(paths, jobs)
+    for export, df in frames.items():
+        print(f"{EXPORT_NAMES[export]}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 2 ** 20:.2f} MB <- {paths[export]}")
+        print(df.dtypes.to_string())
+
+    # report validation issues
+    validation.print_summary()
+    if report_path:
+        validation.write_report(report_path)
+
+if __name__ == '__main__':
+    main()
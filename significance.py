@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+'''
+Tests whether Madeline and the participants really differ in how they refer, rather than only
+comparing the percentages (percentage.py) and mean distances (distance.py) of one sample.
+For the relation proportions and the line and reference # distances it gives
+- a permutation test: the speaker labels are shuffled across the links and the difference
+  (Madeline - Participant) is recomputed, the p value is the share of shuffles at least as far from 0
+- a bootstrap confidence interval of the difference: each speaker's links are resampled with replacement
+Resamples are drawn a batch at a time as NumPy arrays (one row per resample) and can be split across processes.
+'''
+
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import cache
+import instrument
+import percentage
+import query
+
+RESULT_COLUMNS = ['Test', 'Measure', 'Links', 'Madeline', 'Participant', 'Difference', 'CI Low', 'CI High', 'P Value', 'Resamples']
+# most cells (resamples x links x measures) drawn at a time, bounds the memory of a batch
+BATCH_CELLS = 2 ** 22
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -i input_data.feather [-o tests.csv -n resamples -c confidence -j jobs -s seed]
+    -i input_data_path      Output from lingpipe.py (or percentage.py), links with speakers and distances
+    -o output_data_path     Write the test results here as well as printing them
+    -n resamples            Permutations and bootstrap resamples of every test (default 10000)
+    -c confidence           Confidence level of the bootstrap intervals (default 0.95)
+    -j jobs                 Split the resamples across this many processes (default 1)
+    -s seed                 Random seed (default 0)
+{instrument.USAGE}''')
+    sys.exit(exitcode)
+
+def build_tests(df):
+    '''
+    Values to compare between the speakers: whether each link is an Anaphor, Cataphor or Exophora
+    (as a percentage), and the line and reference # distances, overall and for each relation
+    param df: links data frame with Relation Speaker, Line Diff and Ref Diff columns
+    return list of (test name, measure names, float array links x measures, bool array True for Madeline)
+    '''
+    speaker = df['Relation Speaker']
+    known = speaker.isin(list(percentage.SPEAKERS.values())).to_numpy()
+    madeline = (speaker == 'Madeline').to_numpy()
+    relation = df['Relation'].astype(str).to_numpy()
+    tests = [(
+        'Relations',
+        [f"{r} %" for r in percentage.RELATIONS],
+        np.stack([relation[known] == r for r in percentage.RELATIONS], axis=1) * 100.0,
+        madeline[known],
+    )]
+    # distances are only set for links to non-Referent targets
+    distances = df[['Line Diff', 'Ref Diff']].apply(pd.to_numeric, errors='coerce').to_numpy(float)
+    measured = known & ~np.isnan(distances).any(axis=1)
+    for name in ['All'] + percentage.RELATIONS:
+        rows = measured if name == 'All' else measured & (relation == name)
+        if rows.any():
+            tests.append((f"Distance {name}", ['Line Diff', 'Ref Diff'], distances[rows], madeline[rows]))
+    return tests
+
+def batches(resamples, cells):
+    '''
+    param resamples: int, resamples to draw
+    param cells: int, cells of one resample
+    return generator of batch sizes adding up to resamples
+    '''
+    size = max(1, BATCH_CELLS // max(cells, 1))
+    for start in range(0, resamples, size):
+        yield min(size, resamples - start)
+
+def mean_difference(values, groups):
+    '''
+    return float array, mean of each measure for the first group minus the mean for the rest
+    '''
+    return values[groups].mean(axis=0) - values[~groups].mean(axis=0)
+
+def permutation_counts(values, groups, resamples, rng):
+    '''
+    Count the shuffles of the group labels whose difference in means is at least as far from 0 as the observed one
+    param values: float array, links x measures
+    param groups: bool array, True for the first group
+    param resamples: int, shuffles to draw
+    param rng: numpy Generator
+    return int array, one count per measure
+    '''
+    n, k = len(groups), int(groups.sum())
+    total = values.sum(axis=0)
+    # a little slack so shuffles tied with the observed difference are not lost to rounding
+    observed = np.abs(mean_difference(values, groups)) * (1 - 1e-9) - 1e-12
+    labels = groups.astype(np.float64)
+    counts = np.zeros(values.shape[1], dtype=np.int64)
+    for size in batches(resamples, n):
+        # one shuffled labelling per row, then every resample's first group sums in one product
+        shuffled = rng.permuted(np.tile(labels, (size, 1)), axis=1)
+        first = shuffled @ values
+        differences = first / k - (total - first) / (n - k)
+        counts += (np.abs(differences) >= observed).sum(axis=0)
+    return counts
+
+def bootstrap_means(values, resamples, rng):
+    '''
+    Means of resamples drawn with replacement from the rows
+    param values: float array, links x measures
+    param resamples: int, resamples to draw
+    param rng: numpy Generator
+    return float array, resamples x measures
+    '''
+    n, m = values.shape
+    means = []
+    for size in batches(resamples, n * m):
+        rows = rng.integers(0, n, (size, n))
+        means.append(np.stack([values[:, j][rows].mean(axis=1) for j in range(m)], axis=1))
+    return np.concatenate(means) if means else np.zeros((0, m))
+
+def resample(values, groups, resamples, seed):
+    '''
+    Draw the permutations and bootstrap resamples of one test
+    param values: float array, links x measures
+    param groups: bool array, True for Madeline
+    param resamples: int, permutations and bootstrap resamples to draw
+    param seed: numpy SeedSequence (or int)
+    return (int array of permutation counts per measure, float array of bootstrap differences, resamples x measures)
+    '''
+    rng = np.random.default_rng(seed)
+    counts = permutation_counts(values, groups, resamples, rng)
+    differences = bootstrap_means(values[groups], resamples, rng) - bootstrap_means(values[~groups], resamples, rng)
+    return counts, differences
+
+def run_tests(tests, resamples, seed=0, jobs=1):
+    '''
+    Resample every test. With jobs > 1, each test's resamples are split into one share per process
+    and all shares of all tests go to one pool (every share gets its own stream of the test's seed,
+    so results depend on jobs).
+    param tests: list from build_tests
+    param resamples: int, permutations and bootstrap resamples of every test
+    param seed: int, random seed
+    param jobs: int, number of processes
+    return list of (permutation counts, bootstrap differences) as from resample, one per test
+    '''
+    seeds = [np.random.SeedSequence(seed + i) for i in range(len(tests))]
+    if jobs <= 1:
+        return [resample(values, groups, resamples, s) for (test, measures, values, groups), s in zip(tests, seeds)]
+    shares = [resamples // jobs + (i < resamples % jobs) for i in range(jobs)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            [pool.submit(resample, values, groups, share, child) for share, child in zip(shares, s.spawn(jobs))]
+            for (test, measures, values, groups), s in zip(tests, seeds)
+        ]
+        done = [[future.result() for future in parts] for parts in futures]
+    return [(sum(counts for counts, _ in parts), np.concatenate([differences for _, differences in parts])) for parts in done]
+
+def significance_tests(df, resamples=10000, confidence=0.95, seed=0, jobs=1):
+    '''
+    Permutation tests and bootstrap confidence intervals of Madeline - Participant for every measure
+    param df: links data frame with Relation Speaker, Line Diff and Ref Diff columns
+    param resamples: int, permutations and bootstrap resamples of every test
+    param confidence: float, confidence level of the intervals
+    param seed: int, random seed
+    param jobs: int, number of processes
+    return data frame, one row per test and measure
+    '''
+    # a test needs links from both speakers
+    tests = [test for test in build_tests(df) if test[3].any() and not test[3].all()]
+    rows = []
+    for (test, measures, values, groups), (counts, differences) in zip(tests, run_tests(tests, resamples, seed, jobs)):
+        low, high = np.percentile(differences, [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100], axis=0)
+        madeline, participant = values[groups].mean(axis=0), values[~groups].mean(axis=0)
+        for j, measure in enumerate(measures):
+            rows.append({
+                'Test': test,
+                'Measure': measure,
+                'Links': len(groups),
+                'Madeline': madeline[j],
+                'Participant': participant[j],
+                'Difference': madeline[j] - participant[j],
+                'CI Low': low[j],
+                'CI High': high[j],
+                # the observed labelling counts as one of the permutations
+                'P Value': (counts[j] + 1) / (resamples + 1),
+                'Resamples': resamples,
+            })
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    output_data_path = None
+    resamples = 10000
+    confidence = 0.95
+    jobs = 1
+    seed = 0
+    if len(arguments) < 2:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-i':
+            input_data_path = arguments.pop(0)
+        elif argument == '-o':
+            output_data_path = arguments.pop(0)
+        elif argument == '-n':
+            resamples = int(arguments.pop(0))
+        elif argument == '-c':
+            confidence = float(arguments.pop(0))
+        elif argument in ('-j', '--jobs'):
+            jobs = int(arguments.pop(0))
+        elif argument == '-s':
+            seed = int(arguments.pop(0))
+        elif instrument.option(argument, arguments):
+            pass
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    # ensure input data files exists
+    if not os.path.exists(input_data_path):
+        usage(1)
+
+    df = instrument.run('readLinks', query.readLinks, input_data_path)
+    results = instrument.run('significanceTests', significance_tests, df, resamples, confidence, seed, jobs)
+    print(results.to_string(index=False, float_format=lambda v: f"{v:.4}"))
+    if output_data_path:
+        cache.write_table(results, output_data_path)
+    instrument.finish()
+
+if __name__ == '__main__':
+    main()
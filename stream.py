@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+Chunked reading and writing of tables so large exports can be processed without
+holding every row in memory. Excel workbooks are read through openpyxl's read-only
+mode and written through its write-only mode, which streams rows to disk as they are
+appended; CSV, Parquet and Feather files are read and written in row batches.
+'''
+
+import os
+import pandas as pd
+
+# rows converted to cell values at a time when writing a whole table
+WRITE_ROWS = 10000
+# longest sheet name Excel allows
+SHEET_NAME_CHARS = 31
+
+def unique_header(header):
+    '''
+    Name columns the way pandas.read_excel does: blank headers become 'Unnamed: i'
+    and repeated headers get a '.1', '.2'... suffix
+    param header: list, first row of the sheet
+    return list of column names
+    '''
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def iter_excel(path, chunk_rows):
+    '''
+    Read the first sheet of a workbook in chunks through openpyxl's read-only mode
+    param path: str, workbook path
+    param chunk_rows: int, rows per chunk
+    return generator of data frames
+    '''
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        columns = unique_header(next(rows))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        wb.close()
+
+def iter_table(path, chunk_rows):
+    '''
+    Read a table in chunks, format chosen by extension (.feather, .parquet, .csv or Excel).
+    Each chunk keeps its row numbers from the whole table as its index.
+    param path: str, input file path
+    param chunk_rows: int, rows per chunk
+    return generator of data frames
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        chunks = pd.read_csv(path, chunksize=chunk_rows)
+    elif ext == '.parquet':
+        from pyarrow import parquet
+        batches = parquet.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_rows)
+        chunks = (batch.to_pandas() for batch in batches)
+    elif ext == '.feather':
+        from pyarrow import feather
+        table = feather.read_table(path, memory_map=True)
+        chunks = (batch.to_pandas() for batch in table.to_batches(max_chunksize=chunk_rows))
+    else:
+        chunks = iter_excel(path, chunk_rows)
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+def excel_rows(df, index=True):
+    '''
+    Cell values of a chunk of rows for a write-only sheet, missing values left empty
+    param df: data frame
+    param index: bool, start each row with its index label
+    return generator of lists
+    '''
+    cells = df.astype(object).where(df.notna(), None)
+    for row in cells.itertuples(index=index, name=None):
+        yield list(row)
+
+class ChunkWriter:
+    '''
+    Writes a table one chunk at a time, format chosen by extension (.feather, .parquet, .csv or Excel).
+    Every chunk must have the same columns as the first one.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = os.path.splitext(path)[1].lower()
+        self.writer = None
+        self.schema = None
+
+    def write(self, df):
+        '''
+        Append a chunk to the output file
+        param df: data frame
+        '''
+        if self.ext == '.csv':
+            df.to_csv(self.path, index=False, mode='a' if self.writer else 'w', header=not self.writer)
+            self.writer = True
+        elif self.ext in ('.parquet', '.feather'):
+            import pyarrow as pa
+            # later chunks follow the first chunk's types, a column can be all empty in one chunk
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                if self.ext == '.parquet':
+                    from pyarrow import parquet
+                    self.writer = parquet.ParquetWriter(self.path, self.schema)
+                else:
+                    self.writer = pa.ipc.new_file(self.path, self.schema)
+            self.writer.write_table(table)
+        else:
+            if self.writer is None:
+                import openpyxl
+                self.writer = openpyxl.Workbook(write_only=True)
+                self.sheet = self.writer.create_sheet()
+                self.sheet.append([None] + list(df.columns))
+            for row in excel_rows(df):
+                self.sheet.append(row)
+
+    def close(self):
+        '''
+        Finish the output file
+        '''
+        if self.writer is None or self.writer is True:
+            return
+        if self.ext in ('.parquet', '.feather'):
+            self.writer.close()
+        else:
+            self.writer.save(self.path)
+
+class TableWriter:
+    '''
+    Writes a stage output and its summary tables in one pass, format chosen by extension.
+    Excel outputs get one sheet per table in a single write-only workbook, so rows go to disk
+    as they are written and memory does not grow with the output; other formats write the main
+    table to the output path and each other table next to it as <name>_<table name><ext>.
+    '''
+
+    def __init__(self, path, main=None):
+        '''
+        param path: str, output file path
+        param main: str, name of the table written to path itself for non-Excel formats
+        '''
+        self.path = path
+        self.main = main
+        self.base, self.ext = os.path.splitext(path)
+        self.excel = self.ext.lower() not in ('.feather', '.parquet', '.csv')
+        self.workbook = None
+        self.tables = {}
+
+    def table_path(self, name):
+        '''
+        return str, file a table is written to for non-Excel formats
+        '''
+        if name == self.main:
+            return self.path
+        return f"{self.base}_{name.lower().replace(' ', '_')}{self.ext}"
+
+    def append(self, name, df, index=False):
+        '''
+        Append rows to a table, starting its sheet or file on first use
+        param name: str, table (sheet) name
+        param df: data frame, every chunk of a table must have the same columns
+        param index: bool, write the index as the first column (Excel only, like DataFrame.to_excel)
+        '''
+        if not self.excel:
+            if name not in self.tables:
+                self.tables[name] = ChunkWriter(self.table_path(name))
+            self.tables[name].write(df)
+            return
+        if name not in self.tables:
+            if self.workbook is None:
+                import openpyxl
+                self.workbook = openpyxl.Workbook(write_only=True)
+            sheet = self.workbook.create_sheet(name[:SHEET_NAME_CHARS])
+            sheet.append(([df.index.name] if index else []) + [str(c) for c in df.columns])
+            self.tables[name] = sheet
+        sheet = self.tables[name]
+        for row in excel_rows(df, index):
+            sheet.append(row)
+
+    def write(self, name, df, index=False):
+        '''
+        Write a whole table, converting WRITE_ROWS rows at a time
+        param name: str, table (sheet) name
+        param df: data frame
+        param index: bool, as for append
+        '''
+        for start in range(0, max(len(df), 1), WRITE_ROWS):
+            self.append(name, df.iloc[start:start + WRITE_ROWS], index)
+
+    def close(self):
+        '''
+        Finish the output files
+        '''
+        if self.workbook is not None:
+            self.workbook.save(self.path)
+        for table in self.tables.values():
+            if isinstance(table, ChunkWriter):
+                table.close()
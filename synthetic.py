@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+'''
+Generates synthetic ATLAS.ti exports (Quotation Manager and Hyperlink Manager) with matching
+participantNN.txt transcripts, at any scale, for benchmarking the pipeline.
+Documents follow the real project: odd documents are participant transcripts and the next
+even document holds that participant's exophora referents.
+'''
+
+import sys
+import os
+import numpy as np
+import pandas as pd
+import cache
+
+WORDS = ['it', 'this', 'that', 'the file', 'the tool', 'Madeline', 'I', 'you', 'we', 'the PDF', 'the page', 'they']
+PUNCT = ['', '', '', '.', '?', '!']
+# relation: (source code, target code)
+LINK_CODES = {'Anaphor': ('Antecedent', 'Anaphor'), 'Cataphor': ('Cataphor', 'Postcedent'), 'Exophora': ('Exophora', 'Referent')}
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -o output_dir [-n docs -q quotes_per_doc -k links_per_quote -m anaphor,cataphor,exophora -f format -s seed]
+    -o output_dir      Where to write the exports and participant files
+    -n docs            Number of participants (default 10)
+    -q quotes_per_doc  Quotations per participant transcript (default 100)
+    -k links_per_quote Links per quotation (default 0.75)
+    -m relation_mix    Share of Anaphor,Cataphor,Exophora links (default 0.27,0.05,0.68)
+    -f format          Export format: xlsx, csv, parquet or feather (default xlsx)
+    -s seed            Random seed (default 0)''')
+    sys.exit(exitcode)
+
+def transcript(p, lines, rng):
+    '''
+    Build a participant transcript
+    param p: int, participant number
+    param lines: int, number of lines
+    param rng: numpy random generator
+    return list of str lines, every line either starts a speaker turn or continues the last one
+    '''
+    starts = rng.random(lines) < 0.8
+    starts[0] = True
+    madeline = rng.random(lines) < 0.5
+    text = []
+    for i in range(lines):
+        if starts[i]:
+            speaker = 'Madeline - Virtual Assistant' if madeline[i] else f"participant{p:02d}"
+            text.append(f"[{i // 60:02d}:{i % 60:02d}] {speaker}: {WORDS[i % len(WORDS)]} line {i + 1}\n")
+        else:
+            text.append(f"{WORDS[i % len(WORDS)]} continued {i + 1}\n")
+    return text
+
+def pick_after(candidates, sources, rng):
+    '''
+    For each source quotation pick a random candidate quotation that comes after it
+    param candidates: sorted array of candidate positions
+    param sources: array of source positions
+    param rng: numpy random generator
+    return (kept sources, targets), sources with no later candidate are dropped
+    '''
+    first = np.searchsorted(candidates, sources, side='right')
+    after = len(candidates) - first
+    keep = after > 0
+    picks = first[keep] + (rng.random(keep.sum()) * after[keep]).astype(int)
+    return sources[keep], candidates[picks]
+
+def participant(p, quotes, links_per_quote, mix, rng):
+    '''
+    Generate the quotations and links of one participant
+    param p: int, participant number
+    param quotes: int, quotations in the transcript
+    param links_per_quote: float, links per quotation
+    param mix: dict of relation -> share of links
+    param rng: numpy random generator
+    return (quotations data frame, links data frame, transcript lines)
+    '''
+    doc, exo = 2 * p - 1, 2 * p
+    lines = max(quotes // 2, 10)
+    text = transcript(p, lines, rng)
+
+    # transcript quotations in line order, so reference #s increase with lines
+    line = np.sort(rng.integers(1, lines + 1, quotes))
+    codes = rng.choice(['Antecedent', 'Anaphor', 'Cataphor', 'Postcedent', 'Exophora'], quotes, p=[0.15, 0.2, 0.05, 0.05, 0.55])
+    # some quotations carry two codes, like 'Antecedent\nPostcedent' in the real export
+    double = rng.random(quotes) < 0.05
+    codes = np.where(double & (codes == 'Antecedent'), 'Antecedent\nPostcedent', codes)
+    codes = np.where(double & (codes == 'Anaphor'), 'Anaphor\nAntecedent', codes)
+    referents = max(quotes // 10, 1)
+
+    links = []
+    total = int(quotes * links_per_quote)
+    for relation, share in mix.items():
+        sourceCode, targetCode = LINK_CODES[relation]
+        sources = np.flatnonzero(np.char.find(codes.astype(str), sourceCode) >= 0)
+        targets = np.flatnonzero(np.char.find(codes.astype(str), targetCode) >= 0)
+        n = int(total * share)
+        if not len(sources) or n == 0:
+            continue
+        picked = rng.choice(sources, n)
+        if relation == 'Exophora':
+            sids = [f"{doc}:{i + 1}" for i in picked]
+            tids = [f"{exo}:{i + 1}" for i in rng.integers(0, referents, n)]
+        else:
+            picked, targets = pick_after(targets, np.sort(picked), rng)
+            sids = [f"{doc}:{i + 1}" for i in picked]
+            tids = [f"{doc}:{i + 1}" for i in targets]
+        links.append(pd.DataFrame({'ID': sids, 'Relation': relation, 'ID.1': tids}))
+
+    names = np.array(WORDS)[rng.integers(0, len(WORDS), quotes)]
+    qdf = pd.DataFrame({
+        'ID': [f"{doc}:{i + 1}" for i in range(quotes)],
+        'Quotation Name': names,
+        'Document': f"participant{p:02d}",
+        'Document Groups': np.nan,
+        'Quotation Content': names,
+        'Comment': np.nan,
+        'Codes': codes,
+        'Reference': [f"{l} - {l}" for l in line],
+    })
+    rdf = pd.DataFrame({
+        'ID': [f"{exo}:{i + 1}" for i in range(referents)],
+        'Quotation Name': [f"referent {i + 1}" for i in range(referents)],
+        'Document': f"participant{p:02d}_exophoras",
+        'Document Groups': np.nan,
+        'Quotation Content': [f"referent {i + 1}" for i in range(referents)],
+        'Comment': np.nan,
+        'Codes': 'Referent',
+        'Reference': [f"{i + 1} - {i + 1}" for i in range(referents)],
+    })
+    ldf = pd.concat(links, ignore_index=True) if links else pd.DataFrame(columns=['ID', 'Relation', 'ID.1'])
+    return pd.concat([qdf, rdf], ignore_index=True), ldf, text
+
+def generate(docs=10, quotes=100, links_per_quote=0.75, mix=None, seed=0):
+    '''
+    Generate a synthetic project
+    param docs: int, number of participants
+    param quotes: int, quotations per participant transcript
+    param links_per_quote: float, links per quotation
+    param mix: dict of relation -> share of links, defaults to the real project's mix
+    param seed: int, random seed
+    return (quotations data frame, links data frame, dict of participant file name -> transcript lines)
+    '''
+    if mix is None:
+        mix = {'Anaphor': 0.27, 'Cataphor': 0.05, 'Exophora': 0.68}
+    rng = np.random.default_rng(seed)
+    qdfs, ldfs, transcripts = [], [], {}
+    for p in range(1, docs + 1):
+        qdf, ldf, text = participant(p, quotes, links_per_quote, mix, rng)
+        qdfs.append(qdf)
+        ldfs.append(ldf)
+        transcripts[f"participant{p:02d}.txt"] = text
+    qdf = pd.concat(qdfs, ignore_index=True)
+    ldf = pd.concat(ldfs, ignore_index=True)
+
+    # link text is the quotation name, sometimes with accidental ending punctuation
+    names = qdf.set_index('ID')['Quotation Name']
+    punct = np.array(PUNCT)
+    ldf.insert(1, 'Source', ldf['ID'].map(names) + punct[rng.integers(0, len(PUNCT), len(ldf))])
+    ldf.insert(2, 'Unnamed: 2', '○')
+    ldf['Target'] = ldf['ID.1'].map(names) + punct[rng.integers(0, len(PUNCT), len(ldf))]
+
+    # density is the number of links each quotation is part of
+    density = pd.concat([ldf['ID'], ldf['ID.1']]).value_counts()
+    qdf['Density'] = qdf['ID'].map(density).fillna(0).astype(int)
+    return qdf, ldf, transcripts
+
+def write(qdf, ldf, transcripts, output_dir, fmt='xlsx'):
+    '''
+    Write a generated project the way the pipeline reads it
+    param qdf: quotations data frame
+    param ldf: links data frame
+    param transcripts: dict of participant file name -> transcript lines
+    param output_dir: str, output directory
+    param fmt: str, export format: xlsx, csv, parquet or feather
+    return (quotations export path, links export path)
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    quotations_path = os.path.join(output_dir, f"Quotation Manager.{fmt}")
+    links_path = os.path.join(output_dir, f"Hyperlink Manager.{fmt}")
+    for df, path in ((qdf, quotations_path), (ldf, links_path)):
+        if fmt == 'xlsx':
+            df.to_excel(path, index=False)
+        else:
+            cache.write_table(df, path)
+    for name, text in transcripts.items():
+        with open(os.path.join(output_dir, name), 'w') as f:
+            f.writelines(text)
+    return quotations_path, links_path
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    docs, quotes, links_per_quote, mix, fmt, seed = 10, 100, 0.75, None, 'xlsx', 0
+    if len(arguments) < 2:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-o':
+            output_dir = arguments.pop(0)
+        elif argument == '-n':
+            docs = int(arguments.pop(0))
+        elif argument == '-q':
+            quotes = int(arguments.pop(0))
+        elif argument == '-k':
+            links_per_quote = float(arguments.pop(0))
+        elif argument == '-m':
+            mix = dict(zip(LINK_CODES, map(float, arguments.pop(0).split(','))))
+        elif argument == '-f':
+            fmt = arguments.pop(0)
+        elif argument == '-s':
+            seed = int(arguments.pop(0))
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    qdf, ldf, transcripts = generate(docs, quotes, links_per_quote, mix, seed)
+    quotations_path, links_path = write(qdf, ldf, transcripts, output_dir, fmt)
+    print(f"{len(qdf)} quotations -> {quotations_path}")
+    print(f"{len(ldf)} links -> {links_path}")
+    print(f"{len(transcripts)} participant files -> {output_dir}")
+
+if __name__ == '__main__':
+    main()
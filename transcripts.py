@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+'''
+Random access to participant transcripts without reading them into memory.
+Each participantNN.txt is memory-mapped and scanned once for its line offsets, the speaker
+of every line and where each speaker turn starts. That index is saved next to the parsed
+tables (keyed on the file's path, size and mtime like the table cache) and reused until the
+file changes, so any line, turn or line range is then a direct slice of the mapped file.
+'''
+
+import sys
+import os
+import re
+import mmap
+import numpy as np
+import pandas as pd
+import cache
+
+INDEX_DIR = os.path.join(cache.CACHE_DIR, 'transcripts')
+# speaker codes in the index, as in percentage.SPEAKERS, with -1 for lines before the first turn
+NO_SPEAKER = -1
+SCAN_BYTES = 2 ** 26
+
+def usage(exitcode=0):
+    progname = os.path.basename(sys.argv[0])
+    print(f'''Usage: {progname} -d participant_files_dir/ -p participant -n line [-b before -a after]
+    -d participant_files_dir path to participant files
+    -p participant           participant number (ex: 3 for participant03.txt)
+    -n line                  line number (1 indexed) to show with its speaker turn
+    -b before                also show this many lines before it
+    -a after                 also show this many lines after it''')
+    sys.exit(exitcode)
+
+def participant_pattern(doc):
+    '''
+    return compiled pattern matching the speaker markers of a participant's transcript,
+    group 1 is set for participant lines, including the 'particpant' misspelling
+    '''
+    return re.compile(rb'\] (partic(?:i)?pant%02d):|\] Madeline - Virtual Assistant:' % doc)
+
+def index_path(path, index_dir=INDEX_DIR):
+    '''
+    return str, path of the saved index for the current version of a transcript
+    '''
+    return cache.cache_prefix(path, index_dir) + f"{cache.file_key(path)[:16]}.npz"
+
+def line_starts(mm):
+    '''
+    Byte offset of the start of every line, scanning the mapped file in slices
+    param mm: mmap of the file
+    return int64 array, one offset per line plus the file size at the end
+    '''
+    size = len(mm)
+    starts = [np.zeros(1, dtype=np.int64)]
+    for at in range(0, size, SCAN_BYTES):
+        block = np.frombuffer(mm[at:at + SCAN_BYTES], dtype=np.uint8)
+        starts.append(np.flatnonzero(block == ord('\n')).astype(np.int64) + at + 1)
+    starts = np.concatenate(starts)
+    # a last line without a newline still counts, an empty one after the final newline does not
+    if starts[-1] != size:
+        starts = np.append(starts, size)
+    return starts
+
+def build_index(path, doc):
+    '''
+    Scan a transcript once for its line offsets, line speakers and turn starts
+    param path: str, transcript path
+    param doc: int, participant number
+    return dict of arrays: 'offsets' (line i is offsets[i-1]:offsets[i]), 'speakers' (index 0 unused),
+    'turns' (1 indexed line where each turn starts)
+    '''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {'offsets': np.zeros(1, dtype=np.int64), 'speakers': np.full(1, NO_SPEAKER, dtype=np.int8), 'turns': np.zeros(0, dtype=np.int64)}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = line_starts(mm)
+            found = [(m.start(), 0 if m.group(1) else 1) for m in participant_pattern(doc).finditer(mm)]
+    lines = len(offsets) - 1
+    marked = np.full(lines + 1, NO_SPEAKER, dtype=np.int8)
+    if found:
+        at, who = np.array(found).T
+        line = np.searchsorted(offsets, at, side='right')
+        # Madeline first so a participant marker on the same line wins, as in percentage
+        marked[line[who == 1]] = 1
+        marked[line[who == 0]] = 0
+    turns = np.flatnonzero(marked != NO_SPEAKER)
+    # lines without a marker keep the speaker of the last marked line
+    last = np.where(marked != NO_SPEAKER, np.arange(lines + 1), 0)
+    speakers = marked[np.maximum.accumulate(last)]
+    speakers[0] = NO_SPEAKER
+    return {'offsets': offsets, 'speakers': speakers, 'turns': turns}
+
+def save_index(index, saved):
+    '''
+    Save a transcript index and remove the indexes of older versions of the file
+    param index: dict from build_index
+    param saved: str, path from index_path
+    '''
+    index_dir = os.path.dirname(saved)
+    os.makedirs(index_dir, exist_ok=True)
+    # write then rename so an interrupted run never leaves a partial index,
+    # per process since parallel runs can index the same transcript
+    tmp = f"{saved}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f, **index)
+    os.replace(tmp, saved)
+    prefix = saved[:saved.rindex('.', 0, -len('.npz')) + 1]
+    for entry in os.listdir(index_dir):
+        old = os.path.join(index_dir, entry)
+        if old.startswith(prefix) and old.endswith('.npz') and old != saved:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+class Transcript:
+    '''
+    One memory-mapped participant transcript and its line index. Lines are 1 indexed.
+    '''
+
+    def __init__(self, path, doc, index_dir=INDEX_DIR):
+        self.path = path
+        self.doc = doc
+        saved = index_path(path, index_dir) if index_dir else None
+        if saved and os.path.exists(saved):
+            with np.load(saved) as npz:
+                index = {key: npz[key] for key in npz.files}
+        else:
+            index = build_index(path, doc)
+            if saved:
+                save_index(index, saved)
+        self.offsets = index['offsets']
+        self.speakers = index['speakers']
+        self.turns = index['turns']
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if len(self) else b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def close(self):
+        if len(self):
+            self.mm.close()
+        self.file.close()
+
+    def text(self, first, last=None):
+        '''
+        param first: int, first line
+        param last: int, last line (inclusive), None for only the first line
+        return str, the lines without their final line break, lines outside the transcript are left out
+        '''
+        last = first if last is None else last
+        first, last = max(first, 1), min(last, len(self))
+        if first > last:
+            return ''
+        raw = self.mm[self.offsets[first - 1]:self.offsets[last]]
+        return raw.decode('utf-8', errors='replace').replace('\r\n', '\n').rstrip('\n')
+
+    def line(self, n):
+        '''
+        return str, line n
+        '''
+        return self.text(n)
+
+    def speaker(self, n):
+        '''
+        return int, speaker of line n: 0 (P), 1 (M) or -1 (none yet or not a line)
+        '''
+        return int(self.speakers[n]) if 1 <= n <= len(self) else NO_SPEAKER
+
+    def turn(self, n):
+        '''
+        Speaker turn holding line n: the marked line it starts on through the line before the next turn
+        param n: int, line number
+        return (first line, last line), (0, 0) if the line is before the first turn or not a line
+        '''
+        if not 1 <= n <= len(self):
+            return 0, 0
+        i = np.searchsorted(self.turns, n, side='right') - 1
+        if i < 0:
+            return 0, 0
+        last = self.turns[i + 1] - 1 if i + 1 < len(self.turns) else len(self)
+        return int(self.turns[i]), int(last)
+
+    def turn_text(self, n):
+        '''
+        return str, the whole speaker turn holding line n
+        '''
+        first, last = self.turn(n)
+        return self.text(first, last) if first else ''
+
+class TranscriptStore:
+    '''
+    Opens participant transcripts on first use and keeps them open
+    '''
+
+    def __init__(self, ppath, index_dir=INDEX_DIR):
+        self.ppath = ppath
+        self.index_dir = index_dir
+        self.opened = {}
+
+    def __getitem__(self, doc):
+        '''
+        param doc: int, participant number
+        return Transcript of participantNN.txt
+        '''
+        if doc not in self.opened:
+            self.opened[doc] = Transcript(self.ppath + f"participant{doc:02d}.txt", doc, self.index_dir)
+        return self.opened[doc]
+
+    def close(self):
+        for transcript in self.opened.values():
+            transcript.close()
+        self.opened.clear()
+
+    def context(self, docs, lines, before=0, after=0):
+        '''
+        Transcript text around many lines, such as the Source Line or Target Line of links
+        param docs: series, participant number of each line
+        param lines: series, line number of each line
+        param before: int, lines of context before
+        param after: int, lines of context after
+        return series of str, '' where the line is missing
+        '''
+        lines = pd.to_numeric(lines, errors='coerce')
+        texts = [
+            self[int(doc)].text(int(line) - before, int(line) + after) if pd.notna(doc) and pd.notna(line) else ''
+            for doc, line in zip(docs, lines)
+        ]
+        return pd.Series(texts, index=docs.index)
+
+def main():
+    # command line parsing
+    arguments = sys.argv[1:]
+    before = after = 0
+    if len(arguments) < 6:
+        usage(0)
+    while arguments and arguments[0].startswith('-'):
+        argument = arguments.pop(0)
+        if argument == '-d':
+            participant_files_path = arguments.pop(0)
+        elif argument == '-p':
+            doc = int(arguments.pop(0))
+        elif argument == '-n':
+            line = int(arguments.pop(0))
+        elif argument == '-b':
+            before = int(arguments.pop(0))
+        elif argument == '-a':
+            after = int(arguments.pop(0))
+        elif argument == '-h':
+            usage(0)
+        else:
+            usage(1)
+
+    store = TranscriptStore(participant_files_path)
+    transcript = store[doc]
+    first, last = transcript.turn(line)
+    print(f"participant{doc:02d}.txt line {line} of {len(transcript)}, turn {first}-{last}")
+    print(transcript.text(line - before, line + after))
+    store.close()
+
+if __name__ == '__main__':
+    main()
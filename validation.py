@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+'''
+Collects validation issues from the pipeline scripts so they can be written once at the end
+instead of printing every bad row as it is found.
+'''
+
+import os
+import pandas as pd
+import stream
+
+REPORT_COLUMNS = ['Row', 'Rule', 'Message', 'Values']
+
+issues = []
+
+def record(rule, message, df, rows, columns):
+    '''
+    Record an issue for some rows of a data frame
+    param rule: str, short name of the check that failed (ex: 'wrong-target')
+    param message: str, description of the issue
+    param df: data frame
+    param rows: boolean series or list of index labels with the issue
+    param columns: list, columns holding the offending values (ex: ['SID', 'TID'])
+    '''
+    bad = df.loc[rows, columns]
+    if bad.empty:
+        return
+    values = columns[0] + '=' + bad[columns[0]].astype(str)
+    for col in columns[1:]:
+        values = values + '; ' + col + '=' + bad[col].astype(str)
+    issues.append(pd.DataFrame({'Row': bad.index, 'Rule': rule, 'Message': message, 'Values': values.values}))
+
+def report():
+    '''
+    return data frame with one row per recorded issue
+    '''
+    if not issues:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    return pd.concat(issues, ignore_index=True)
+
+def clear():
+    '''
+    Forget all recorded issues
+    '''
+    issues.clear()
+
+def print_summary():
+    '''
+    Prints the number of issues found for each rule
+    '''
+    rdf = report()
+    if rdf.empty:
+        print("Validation: no issues")
+        return
+    print(f"Validation: {len(rdf)} issues")
+    for rule, count in rdf['Rule'].value_counts(sort=False).items():
+        print(f"    {rule}: {count}")
+
+def write_report(path):
+    '''
+    Writes all recorded issues to a file, format chosen by extension (.csv, .parquet or .xlsx)
+    param path: str, report file path
+    '''
+    rdf = report()
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        rdf.to_csv(path, index=False)
+    elif ext == '.parquet':
+        rdf.to_parquet(path, index=False)
+    else:
+        writer = stream.TableWriter(path)
+        writer.write('Validation', rdf)
+        writer.close()